@@ -74,16 +74,16 @@ def make_score():
             for n in s.pcset:
                 chord.append(pitch.Pitch24(n.pc))
             s_list.append(chord)
-    chords = xml_gen.make_music21_list(s_list, [4.0 for item in s_list])
-    for c in chords:
-        xml_gen.make_semi_closed(c)
-        xml_gen.cleanup_semi_closed(c)
+    spelling = xml_gen.SpellingCache(google_drive + "\\Composition\\Compositions\\Trombone Piece\\spellings.tsv",
+                                     cleanup=True)
+    chords = xml_gen.make_music21_list(s_list, [4.0 for item in s_list], spelling)
 
     # Make the score
     xml_gen.add_measures(score, len(s_list), meter="4/4")
     xml_gen.add_item(score[1], music21.clef.BassClef(), 1)
     xml_gen.add_sequence(score[1], chords, lyrics)
     xml_gen.export_to_xml(score, google_drive + "\\Composition\\Compositions\\Trombone Piece\\trombone.xml")
+    spelling.save()
 
 
 if __name__ == "__main__":
@@ -6,10 +6,10 @@ This file contains functionality for converting MusicXML data into SuperCollider
 Copyright © 2022 by Jeff Martin. All rights reserved.
 """
 
-from mgen import xml_parse_sc, sc_data_gen
+from mgen import pipeline, xml_parse_sc, sample_map, sc_data_gen, sc_effects
 from mgen.xml_parse_sc import Dynamic, Note, Sound, Pan
-import random
-import time
+import numpy as np
+import sys
 
 # File names and locations
 OUTPUT_DESKTOP = "D:\\SuperCollider\\erudition_i"
@@ -23,22 +23,32 @@ FILE1_debug = "Trombone Piece 0.2.4.1a_debug - Full score - 01 erudition I.xml"
 NUM_BUFFERS = 24
 NUM_BUSES = 80
 CHANGE_BUS_CONSTANT = 20
-random.seed(time.time())
+
+# The default random seed for short-note buffer choices. A different seed can be passed on the command line.
+SEED = 2022
+
+# A map that lists the pitch integer for each buffer. This is microtonal pitch with pcs from 0-23.
+BUF_MAP = sample_map.SampleMap([-48, -44, -40, -38, -34, -30, -26, -24, -20, -16, -14, -10, -6, -2, 0, 4, 8, 10, 14,
+                                18, 22, 24, 28, 32])
 
 # this represents dynamic levels from 0-9. it allows easy adjusting project-wide.
 d = [0, 1, 2, 5, 7, 9, 13, 17, 22, 28]
 
 
-def add_sc_data(new_parts):
+def add_sc_data(new_parts, rng):
     """
     Adds buffer indices to a list of new parts for SuperCollider
     :param new_parts: A list of new parts
+    :param rng: The numpy random Generator for short-note buffer choices
     :return:
     """
     # The current voice
     i = 0
     for part in new_parts:
         for voice in part:
+            # Compute the equal loudness levels for the whole voice at once
+            muls = xml_parse_sc.equal_loudness_array([item.pitch.p for item in voice if type(item) == Note]).tolist()
+            mul_index = 0
             for j in range(len(voice)):
                 # Convert the times to floats
                 voice[j].duration = float(voice[j].duration)
@@ -47,9 +57,9 @@ def add_sc_data(new_parts):
 
                 # Adjust volume and add buffers and envelopes
                 if type(voice[j]) == Note:
-                    voice[j].mul = xml_parse_sc.equal_loudness(voice[j])
+                    voice[j].mul = muls[mul_index]
+                    mul_index += 1
                     voice[j].legato = 4
-                    add_buf(voice[j])
                     add_env(voice[j])
                 elif type(voice[j]) == Sound:
                     voice[j].mul = 0.15
@@ -63,32 +73,21 @@ def add_sc_data(new_parts):
                     voice[j].wait = float(voice[j + 1].start_time - voice[j].start_time)
                 else:
                     voice[j].wait = 0
+
+            # Add buffers to the whole voice at once
+            add_bufs([item for item in voice if type(item) == Note], rng)
             i += 1
 
 
-def add_buf(note):
+def add_bufs(notes, rng):
     """
-    Adds a buffer to a Note
-    :param note: A Note
+    Adds buffers to a list of Notes. Long notes get the nearest buffer, and short notes get a random buffer,
+    but not one that is too low. Otherwise we'll have too much snazz.
+    :param notes: A list of Notes
+    :param rng: The numpy random Generator for short-note buffer choices
     :return:
     """
-    # A map that lists the pitch integer for each buffer. This is microtonal pitch with pcs from 0-23.
-    buf_map = [-48, -44, -40, -38, -34, -30, -26, -24, -20, -16, -14, -10, -6, -2, 0, 4, 8, 10, 14, 18, 22, 24, 28, 32]
-
-    # Choose a sensible buffer for long notes
-    if note.pitch.p < buf_map[0]:
-        note.buffer = 0
-    elif note.pitch.p > buf_map[len(buf_map) - 1]:
-        note.buffer = len(buf_map) - 1
-    else:
-        for i in range(len(buf_map)):
-            if abs(note.pitch.p - buf_map[i]) <= 2:
-                note.buffer = i
-
-    # For short notes, choose a random buffer, but don't go too low. Otherwise we'll have too much snazz.
-    if note.duration < 0.5:
-        lower_limit = max(0, note.buffer - 3)
-        note.buffer = random.randrange(lower_limit, NUM_BUFFERS - 1, 1)
+    BUF_MAP.assign_buffers(notes, short_duration=0.5, short_spread=3, num_buffers=NUM_BUFFERS, rng=rng)
 
 
 def add_effects(new_parts, effect_parts):
@@ -98,127 +97,7 @@ def add_effects(new_parts, effect_parts):
     :param effect_parts: A list of dynamic parts
     :return:
     """
-    NOTE_END_TIME_PADDING = 0.05
-
-    # Iterate through each effect entry for the current voice
-    for effect in effect_parts:
-        # Identify the starting note
-        start_note = new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]]
-        if type(start_note) == list:
-            for item in start_note:
-                if type(item) == Note or type(item) == Sound:
-                    start_note = item
-                    break
-
-        # Pan effects are easy to add
-        if type(effect) == Pan:
-            effect.bus_in = start_note.bus_out
-            effect.duration = start_note.duration
-            effect.measure = start_note.measure
-            effect.start_time = start_note.start_time
-
-        # For normal effects, we need to update buses, etc.
-        else:
-            # Identify the ending note
-            end_note = new_parts[effect.end_note[0]][effect.end_note[1]][effect.end_note[2]]
-            if type(end_note) == list:
-                for item in end_note:
-                    if type(item) == Note or type(item) == Sound:
-                        end_note = item
-                        break
-
-            # Set times and duration
-            effect.start_time = start_note.start_time
-            effect.end_time = end_note.start_time + end_note.duration + NOTE_END_TIME_PADDING
-            effect.measure = start_note.measure
-            effect.duration = effect.end_time - effect.start_time
-
-            bus = -1  # The bus for the effect
-            first_idx = 0  # The index of the first note affected by the effect
-
-            # Get the appropriate bus to use for the effect, and record the index of the first note affected
-            for i in range(len(new_parts[effect.voice_index[0]][effect.voice_index[1]])):
-                done = False
-                # If we've encountered separate chaining, look inside the list
-                if type(new_parts[effect.voice_index[0]][effect.voice_index[1]][i]) == list:
-                    for item in new_parts[effect.voice_index[0]][effect.voice_index[1]][i]:
-                        if (type(item) == Note or type(item) == Sound) and item.start_time >= effect.start_time and \
-                                item.end_time <= effect.end_time:
-                            bus = item.bus_out
-                            first_idx = i
-                            done = True
-                            break
-                elif new_parts[effect.voice_index[0]][effect.voice_index[1]][i].start_time >= effect.start_time and \
-                        new_parts[effect.voice_index[0]][effect.voice_index[1]][i].end_time <= effect.end_time:
-                    bus = new_parts[effect.voice_index[0]][effect.voice_index[1]][i].bus_out
-                    first_idx = i
-                    done = True
-                if done:
-                    break
-
-            # Update the buses of the effect
-            effect.bus_out = bus
-            effect.bus_in = effect.bus_out - CHANGE_BUS_CONSTANT
-
-            # Update the buses of affected notes
-            for i in range(first_idx, len(new_parts[effect.voice_index[0]][effect.voice_index[1]])):
-                done = False
-
-                # If we're doing separate chaining
-                if type(new_parts[effect.voice_index[0]][effect.voice_index[1]][i]) == list:
-                    for item in new_parts[effect.voice_index[0]][effect.voice_index[1]][i]:
-                        if done:
-                            break
-                        if type(item) == Note or type(item) == Sound:
-                            if item.start_time > effect.end_time:
-                                done = True
-                            elif item.end_time > effect.end_time + NOTE_END_TIME_PADDING:
-                                done = True
-                            else:
-                                item.bus_out -= CHANGE_BUS_CONSTANT
-                elif new_parts[effect.voice_index[0]][effect.voice_index[1]][i].start_time > effect.end_time:
-                    done = True
-                elif new_parts[effect.voice_index[0]][effect.voice_index[1]][i].end_time > \
-                        effect.end_time + NOTE_END_TIME_PADDING:
-                    done = True
-                else:
-                    new_parts[effect.voice_index[0]][effect.voice_index[1]][i].bus_out -= CHANGE_BUS_CONSTANT
-                if done:
-                    break
-
-        # Now we need to duplicate the effect to deal with the alternating buses in adjacent notes,
-        # a feature we implemented to allow legato. At this point, only dynamics are implemented, because
-        # Effect objects are not used in this piece
-        effect2 = None
-        if type(effect) == Dynamic:
-            effect2 = Dynamic(synth=effect.synth, start_note=effect.start_note, end_note=effect.end_note,
-                              voice_index=effect.voice_index, levels=effect.levels, times=effect.times,
-                              curves=effect.curves, duration=effect.duration, start_time=effect.start_time,
-                              end_time=effect.end_time, measure=effect.measure)
-            if effect.bus_in % 2 == 0:
-                effect2.bus_in = effect.bus_in + 1
-                effect2.bus_out = effect.bus_out + 1
-            else:
-                effect2.bus_in = effect.bus_in - 1
-                effect2.bus_out = effect.bus_out - 1
-
-        # When adding effects, we use separate chaining. That is, we create a list containing the effect
-        # and starting note, and put that list into the voice where the starting note used to be.
-        # We will go through the voice and flatten it out later, after all dynamics and effects are added.
-        # This allows us to easily add dynamics and effects by index.
-        if effect2 is not None:
-            if type(new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]]) != list:
-                item_list = [effect, effect2, new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]]]
-                new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]] = item_list
-            else:
-                new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]].insert(0, effect2)
-                new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]].insert(0, effect)
-        else:
-            if type(new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]]) != list:
-                item_list = [effect, new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]]]
-                new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]] = item_list
-            else:
-                new_parts[effect.start_note[0]][effect.start_note[1]][effect.start_note[2]].insert(0, effect)
+    sc_effects.place_effects(new_parts, effect_parts, CHANGE_BUS_CONSTANT)
 
 
 def add_env(note):
@@ -299,17 +178,23 @@ def batch_dynamic_synth_update(new_parts):
                             item2.times = [float(n * item2.duration) for n in item2.times]
 
 
-def build_score():
+def build_score(seed=SEED, max_workers=1, print_report=False):
     """
     Builds the SuperCollider score
-    :return:
+    :param seed: The random seed for short-note buffer choices. The same seed always builds the same score.
+    :param max_workers: The number of processes for running pipeline stages in parallel. None of the stages here
+    are heavy enough to pay for worker processes, so the default runs them all in this process.
+    :param print_report: Whether or not to print the pipeline profile report for each score
+    :return: A dictionary of score name -> pipeline profile report
     """
     parsed_parts1 = xml_parse_sc.analyze_xml(FILE1)
     parsed_parts2 = xml_parse_sc.analyze_xml(FILE2)
 
     # Add data
-    add_sc_data(parsed_parts1)
-    add_sc_data(parsed_parts2)
+    print(f"Random seed: {seed}")
+    rng = np.random.default_rng(seed)
+    add_sc_data(parsed_parts1, rng)
+    add_sc_data(parsed_parts2, rng)
 
     # Output the score for manual edit planning
     xml_parse_sc.dump_parts(parsed_parts1)
@@ -1871,9 +1756,6 @@ def build_score():
         [[0, 6, 1], 10, [0.2, 0.2], [1], [0]],
     ]
 
-    batch_fm_synth_update(parsed_parts1, synth_updates1)
-    batch_fm_synth_update(parsed_parts2, synth_updates2)
-
     # adjust dynamics of individual notes
     # m25
     parsed_parts1[0][0][23].mul *= d[3]
@@ -2495,19 +2377,25 @@ def build_score():
     parsed_parts1[0][0][231].buffer = "\"k\""
     parsed_parts1[0][0][235].buffer = "\"v\""
 
-    add_effects(parsed_parts1, pan1l)
-    add_effects(parsed_parts1, dynamics1)
-    batch_dynamic_synth_update(parsed_parts1)
-    collapse_voices(parsed_parts1)
-
-    add_effects(parsed_parts2, pan2l)
-    add_effects(parsed_parts2, dynamics2)
-    batch_dynamic_synth_update(parsed_parts2)
-    collapse_voices(parsed_parts2)
-
-    # Create the SuperCollider score
-    xml_parse_sc.dump_sc_to_file(f"{OUTPUT}\\score1", parsed_parts1, "score1")
-    xml_parse_sc.dump_sc_to_file(f"{OUTPUT}\\score2", parsed_parts2, "score2")
+    # Update synths, add effects, and create the SuperCollider scores
+    reports = {}
+    for parsed_parts, synth_updates, pans, dynamics, score_name in (
+            (parsed_parts1, synth_updates1, pan1l, dynamics1, "score1"),
+            (parsed_parts2, synth_updates2, pan2l, dynamics2, "score2")):
+        score_pipeline = pipeline.Pipeline()
+        score_pipeline.add_stage("batch_fm_synth_update", batch_fm_synth_update, synth_updates)
+        score_pipeline.add_stage("add_effects (pans)", add_effects, pans)
+        score_pipeline.add_stage("add_effects (dynamics)", add_effects, dynamics)
+        score_pipeline.add_stage("batch_dynamic_synth_update", batch_dynamic_synth_update)
+        score_pipeline.add_stage("collapse_voices", collapse_voices)
+        score_pipeline.add_stage("dump_sc_to_file", lambda parts, name: xml_parse_sc.dump_sc_to_file(
+            f"{OUTPUT}\\{name}", parts, name, incremental=True), score_name)
+        score_pipeline.run(parsed_parts, max_workers)
+        reports[score_name] = score_pipeline.report()
+        if print_report:
+            print(score_name)
+            print(reports[score_name])
+    return reports
 
 
 def collapse_voices(new_parts):
@@ -2516,21 +2404,8 @@ def collapse_voices(new_parts):
     :param new_parts: A list of parts
     :return: None
     """
-    for part in new_parts:
-        for voice in part:
-            i = 0
-            while i < len(voice):
-                if type(voice[i]) == list:
-                    if len(voice[i]) > 0:
-                        current = voice[i]
-                        for j in range(len(current) - 1, -1, -1):
-                            voice.insert(i, current[j])
-                        current.clear()
-                    else:
-                        del voice[i]
-                else:
-                    i += 1
+    sc_effects.collapse_voices(new_parts)
 
 
 if __name__ == "__main__":
-    build_score()
+    build_score(int(sys.argv[1]) if len(sys.argv) > 1 else SEED, print_report=True)
@@ -182,10 +182,13 @@ def make_draft_2():
     s[2][len(s[1]) - 1].rightBarline = "double"
     xml_gen.add_measures(s, 21, 90, None, "4/4")
 
+    # Index the measures so items can be added without scanning the parts
+    builder = xml_gen.ScoreBuilder(s)
+
     # Add tempo markings
-    xml_gen.add_item(s[1], music21.tempo.MetronomeMark(None, 60, music21.note.Note(type="quarter")), 1)
-    xml_gen.add_item(s[1], music21.tempo.MetronomeMark(None, 120, music21.note.Note(type="quarter")), 41)
-    xml_gen.add_item(s[1], music21.tempo.MetronomeMark(None, 60, music21.note.Note(type="quarter")), 79)
+    builder.add_item(s[1], music21.tempo.MetronomeMark(None, 60, music21.note.Note(type="quarter")), 1)
+    builder.add_item(s[1], music21.tempo.MetronomeMark(None, 120, music21.note.Note(type="quarter")), 41)
+    builder.add_item(s[1], music21.tempo.MetronomeMark(None, 60, music21.note.Note(type="quarter")), 79)
 
     # Add note durations
     durations = []
@@ -202,18 +205,18 @@ def make_draft_2():
 
     # Create the top lyrics
     lyrics_top = [[set_names[i], chord_names[i], chord_cards[i]] for i in range(len(pcsets))]
-    pcsets2 = xml_gen.make_music21_list(pcsets, durations)
-    for chord in pcsets2:
-        xml_gen.make_semi_closed(chord)
+    spelling = xml_gen.SpellingCache(r"H:\My Drive\Composition\Dorico\spellings.tsv")
+    pcsets2 = xml_gen.make_music21_list(pcsets, durations, spelling)
     bass2 = [music21.note.Note(p + 24, quarterDuration=durations[i]) for p in bass]
     
     # Add notes
-    xml_gen.add_sequence(s[1], pcsets2, lyrics_top, 1, 4, 0)
-    xml_gen.add_sequence(s[2], bass2, lower_names, 1, 4, 0)
+    builder.add_sequence(s[1], pcsets2, lyrics_top, 1, 4)
+    builder.add_sequence(s[2], bass2, lower_names, 1, 4)
 
     # Render the score in MusicXML
     # s.show()
     xml_gen.export_to_xml(s, r"H:\My Drive\Composition\Dorico\draft9.xml")
+    spelling.save()
 
 
 def make_common_tones():
@@ -7,8 +7,7 @@ Date: 11/13/21
 This file contains functionality for working with subsets.
 """
 
-import pctheory.pcset as pcset
-import pctheory.pitch as pitch
+from mgen import set_class_table
 
 pcsets = [
     [
@@ -99,24 +98,15 @@ pcsets = [
 k = 0
 
 
-pcsets2 = []
-for pc in pcsets[k]:
-    pcsets2.append([pitch.PitchClass12(p) for p in pc])
-#s = pcset.make_pcset(1, 2, 5, 9, 10, 11)
-#s = pcset.make_pcset(1, 3, 4, 5, 7, 8, 11)
-
-for i in range(len(pcsets2)):
-    sub = pcset.subsets(set(pcsets2[i]))
+table = set_class_table.get_table()
+filters = ["[026]", "[015]"]
+subsets = table.find_subsets(pcsets[k], filters)
 
+for i in range(len(pcsets[k])):
     print(pcsets[k][i], "\n")
-    filter = pcset.set_class_filter12("[026]", sub)
-    print("[026]")
-    for i in filter:
-        print(i)
-
-    filter = pcset.set_class_filter12("[015]", sub)
-    print("\n[015]")
-    for i in filter:
-        print(i)
+    for j in range(len(filters)):
+        print(("\n" if j > 0 else "") + filters[j])
+        for mask in subsets[i][filters[j]]:
+            print(set_class_table.get_pcset(int(mask)))
 
     print("\n********************************\n")
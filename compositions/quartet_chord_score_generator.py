@@ -1,6 +1,6 @@
 import pctheory.pseg as pseg
 import pctheory.pset as pset
-from mgen import xml_gen
+from mgen import xml_gen, xml_writer
 import os
 import numpy as np
 import functools
@@ -37,10 +37,8 @@ pseg_list = [base_pseg, [-np.inf, -np.inf],
 # score1.show()
 # xml_gen.export_to_xml(score1, os.path.join(PATH, "chords.xml"))
 
-# Pseg score
-score2 = xml_gen.create_score_piano(num_measures=500)
+# Pseg score. This is written directly from the compact list, without building a music21 score.
 pseg_list = functools.reduce(lambda z, y :z + y, pseg_list)
-xml_gen.add_sequence(score2[1], xml_gen.make_music21_list(pseg_list, [1 for x in pseg_list]))
-xml_gen.remove_empty_measures(score2)
-# score2.show()
-xml_gen.export_to_xml(score2, os.path.join(PATH, "psegs.xml"))
+xml_writer.write_score(os.path.join(PATH, "psegs.xml"),
+                       [xml_writer.XmlPart(name="Piano", abbreviation="Pno.",
+                                           items=xml_writer.make_compact_list(pseg_list, [1 for x in pseg_list]))])
@@ -7,6 +7,7 @@ Here is a test from the desktop
 """
 
 from pctheory import pcset, tables, transformations
+from mgen import corpus_index
 
 # The data table
 data_table = tables.create_tables()
@@ -37,32 +38,24 @@ def make_corpus(pcsets):
     """
     Makes the pcset corpus for the piece
     :param pcsets: The pcsets in prime form
-    :return: The corpus
+    :return: The corpus, as an array of pcset masks
     """
-    piece_corpus = set()
-    for s in pcsets:
-        c = pcset.get_corpus(s)
-        piece_corpus = piece_corpus.union(c)
-    return piece_corpus
+    return corpus_index.get_corpus_union(pcsets)
 
 
-def search_corpus(piece_corpus, search_set):
+def search_corpus(index, search_set):
     """
     Searches a corpus for a provided set
-    :param piece_corpus: The piece corpus
+    :param index: A CorpusIndex of the piece corpus
     :param search_set: A set
     :return: The set(s) that contain the provided set
     """
-    contains = set()
-    for p in piece_corpus:
-        if search_set.issubset(p) or search_set == p:
-            contains.add(p)
-    return contains
+    return index.to_pcsets(index.supersets(search_set))
 
 
 if __name__ == "__main__":
     sets = make_pcsets()
-    pierrot_corpus = make_corpus(sets)
+    pierrot_corpus = corpus_index.CorpusIndex(make_corpus(sets))
     search = search_corpus(pierrot_corpus, current)
     for item in search:
         print(item)
@@ -6,7 +6,7 @@ This file takes four trichords and generates all possible set-class unions of th
 """
 
 from pctheory import group, pcseg, pcset, pitch, set_complex, tables, transformations
-from mgen import xml_gen
+from mgen import chooser, set_class_table, xml_gen
 import music21
 
 google_drive = "H:\\My Drive"
@@ -44,32 +44,19 @@ for s in sets:
     for i in range(0, 12):
         sets[s].append(t[f"T{i}M11"].transform(sets[s][0]))
 
-for u in unions:
-    match(len(u)):
-        case 2:
-            for s in sets[u[0]]:
-                for t in sets[u[1]]:
-                    tempset = s.union(t)
-                    sc1 = pcset.SetClass12(x, tempset)
-                    unions[u].add(sc1)
-        case 3:
-            for s in sets[u[0]]:
-                for t in sets[u[1]]:
-                    tempset = s.union(t)
-                    for v in sets[u[2]]:
-                        tempset2 = tempset.union(v)
-                        sc1 = pcset.SetClass12(x, tempset2)
-                        unions[u].add(sc1)
-        case 4:
-            for s in sets[u[0]]:
-                for t in sets[u[1]]:
-                    tempset = s.union(t)
-                    for v in sets[u[2]]:
-                        tempset2 = tempset.union(v)
-                        for w in sets[u[3]]:
-                            tempset3 = tempset2.union(w)
-                            sc1 = pcset.SetClass12(x, tempset3)
-                            unions[u].add(sc1)
+
+def find_unions(max_workers=4):
+    """
+    Finds the set classes of the unions, using a census of pcset masks so only one SetClass12 is made
+    for each set class
+    :param max_workers: The number of processes for the census
+    :return:
+    """
+    groups = {s: [[pc.pc for pc in p] for p in sets[s]] for s in sets}
+    census = chooser.union_census(groups, list(unions.keys()), max_workers)
+    for u in unions:
+        for prime_form in census[u]:
+            unions[u].add(pcset.SetClass12(x, pcset.make_pcset12(*sorted(set_class_table.get_pcset(prime_form)))))
 
 
 def print_unions():
@@ -119,4 +106,5 @@ def make_score():
 
 
 if __name__ == "__main__":
+    find_unions()
     make_score()
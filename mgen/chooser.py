@@ -1,3 +1,14 @@
+"""
+File: chooser.py
+Author: Jeff Martin
+This file finds the unions of combinations of named pcsets. Pcsets are handled as 12-bit integer masks,
+so unions are a single OR and duplicates are found with a dictionary.
+Because it imports from the mgen package, run it as a module from the repository root: python -m mgen.chooser
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from .set_class_table import get_mask, get_pcset, get_prime_forms
+
 sets = [
     ("A T0", {0, 1, 3, 5, 7, 9}),
     ("A T1", {1, 2, 4, 6, 8, 10}),
@@ -49,31 +60,91 @@ sets = [
     ("B T11I", {3, 6, 7, 9, 10, 11})
 ]
 
-card7 = []
-card8 = []
-card9 = []
-card10 = []
 
-# produce all combinations
-for tup1 in sets:
-    for tup2 in sets:
-        newset = tup1[1].union(tup2[1])
-        if len(newset) == 7:
-            card7.append((f"{tup1[0]} U {tup2[0]}", newset))
-        if len(newset) == 8:
-            card8.append((f"{tup1[0]} U {tup2[0]}", newset))
-        if len(newset) == 9:
-            card9.append((f"{tup1[0]} U {tup2[0]}", newset))
-        if len(newset) == 10:
-            card10.append((f"{tup1[0]} U {tup2[0]}", newset))
+def enumerate_unions(named_pcsets, k, cardinalities=None):
+    """
+    Enumerates the unions of all k-way combinations of named pcsets. Each distinct union is only listed once,
+    under the name of the first combination that produced it.
+    :param named_pcsets: A list of (name, pcset) tuples
+    :param k: The number of pcsets in each combination
+    :param cardinalities: An optional collection of union cardinalities to keep. Combinations whose partial
+    union is already larger than the largest of these are skipped.
+    :return: A dictionary of cardinality -> list of (name, pcset) tuples
+    """
+    names = [item[0] for item in named_pcsets]
+    masks = [get_mask(item[1]) for item in named_pcsets]
+    max_cardinality = max(cardinalities) if cardinalities is not None else 12
+    unions = {}  # mask -> name
+
+    def visit(start, depth, mask, chosen):
+        for i in range(start, len(masks) - (k - depth) + 1):
+            new_mask = mask | masks[i]
+            if new_mask.bit_count() > max_cardinality:
+                continue
+            chosen.append(i)
+            if depth + 1 == k:
+                if new_mask not in unions:
+                    unions[new_mask] = " U ".join(names[j] for j in chosen)
+            else:
+                visit(i + 1, depth + 1, new_mask, chosen)
+            chosen.pop()
+
+    if 0 < k <= len(masks):
+        visit(0, 0, 0, [])
+    buckets = {}
+    for mask, name in unions.items():
+        cardinality = mask.bit_count()
+        if cardinalities is None or cardinality in cardinalities:
+            if cardinality not in buckets:
+                buckets[cardinality] = []
+            buckets[cardinality].append((name, get_pcset(mask)))
+    return buckets
+
+
+def get_union_prime_forms(starts, groups):
+    """
+    Gets the prime forms of the unions of masks drawn from each of several groups
+    :param starts: The masks for the first group
+    :param groups: A list of lists of masks for the remaining groups
+    :return: A set of prime form masks
+    """
+    unions = set(starts)
+    for group in groups:
+        unions = {union | mask for union in unions for mask in group}
+    prime_forms = get_prime_forms()
+    return {int(prime_forms[union]) for union in unions}
+
+
+def union_census(groups, keys, max_workers=1):
+    """
+    Finds the set classes of the unions of pcsets drawn from named groups. For example, if the groups are
+    every Tn/TnI form of several trichords, the census for the key "stu" holds the set class of every union
+    of a form of s, a form of t, and a form of u. Partial unions are deduplicated as masks at each step,
+    and are only reduced to prime forms at the end, so no set class objects are made.
+    :param groups: A dictionary of group name -> list of pcsets
+    :param keys: A list of keys. Each key is a sequence of group names, such as "stu".
+    :param max_workers: The number of processes. If greater than 1, the forms of the first group in each
+    key are spread across the processes.
+    :return: A dictionary of key -> set of prime form masks
+    """
+    group_masks = {name: sorted({get_mask(pcset) for pcset in groups[name]}) for name in groups}
+    census = {}
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for key in keys:
+                starts = group_masks[key[0]]
+                rest = [group_masks[name] for name in key[1:]]
+                futures[key] = [executor.submit(get_union_prime_forms, starts[i::max_workers], rest)
+                                for i in range(max_workers)]
+            for key in futures:
+                census[key] = set().union(*[future.result() for future in futures[key]])
+    else:
+        for key in keys:
+            census[key] = get_union_prime_forms(group_masks[key[0]], [group_masks[name] for name in key[1:]])
+    return census
 
-# remove duplicates
-for i in range(len(card9)):
-    if i < len(card9):
-        for j in range(i + 1, len(card9)):
-            while j < len(card9) and card9[i][1] == card9[j][1]:
-                del card9[j]
 
-# display results
-for item in card9:
-    print(item)
\ No newline at end of file
+if __name__ == "__main__":
+    for item in enumerate_unions(sets, 2, [9])[9]:
+        print(item)
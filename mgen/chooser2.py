@@ -1,79 +0,0 @@
-sets = [
-    ("A T0", {0, 1, 3, 5, 7, 9}),
-    ("A T1", {1, 2, 4, 6, 8, 10}),
-    ("A T2", {2, 3, 5, 7, 9, 11}),
-    ("A T3", {0, 3, 4, 6, 8, 10}),
-    ("A T4", {1, 4, 5, 7, 9, 11}),
-    ("A T5", {0, 2, 5, 6, 8, 10}),
-    ("A T6", {1, 3, 6, 7, 9, 11}),
-    ("A T7", {0, 2, 4, 7, 8, 10}),
-    ("A T8", {1, 3, 5, 8, 9, 11}),
-    ("A T9", {0, 2, 4, 6, 9, 10}),
-    ("A T10", {1, 3, 5, 7, 10, 11}),
-    ("A T11", {0, 2, 4, 6, 8, 11}),
-    ("A T0I", {0, 3, 5, 7, 9, 11}),
-    ("A T1I", {0, 1, 4, 6, 8, 10}),
-    ("A T2I", {1, 2, 5, 7, 9, 11}),
-    ("A T3I", {0, 2, 3, 6, 8, 10}),
-    ("A T4I", {1, 3, 4, 7, 9, 11}),
-    ("A T5I", {0, 2, 4, 5, 8, 10}),
-    ("A T6I", {1, 3, 5, 6, 9, 11}),
-    ("A T7I", {0, 2, 4, 6, 7, 10}),
-    ("A T8I", {1, 3, 5, 7, 8, 11}),
-    ("A T9I", {0, 2, 4, 6, 8, 9}),
-    ("A T10I", {1, 3, 5, 7, 9, 10}),
-    ("A T11I", {2, 4, 6, 8, 10, 11}),
-    ("B T0", {0, 1, 2, 4, 5, 8}),
-    ("B T1", {1, 2, 3, 5, 6, 9}),
-    ("B T2", {2, 3, 4, 6, 7, 10}),
-    ("B T3", {3, 4, 5, 7, 8, 11}),
-    ("B T4", {0, 4, 5, 6, 8, 9}),
-    ("B T5", {1, 5, 6, 7, 9, 10}),
-    ("B T6", {2, 6, 7, 8, 10, 11}),
-    ("B T7", {0, 3, 7, 8, 9, 11}),
-    ("B T8", {0, 1, 4, 8, 9, 10}),
-    ("B T9", {1, 2, 5, 9, 10, 11}),
-    ("B T10", {0, 2, 3, 6, 10, 11}),
-    ("B T11", {0, 1, 3, 4, 7, 11}),
-    ("B T0I", {0, 4, 7, 8, 10, 11}),
-    ("B T1I", {0, 1, 5, 8, 9, 11}),
-    ("B T2I", {0, 1, 2, 6, 9, 10}),
-    ("B T3I", {1, 2, 3, 7, 10, 11}),
-    ("B T4I", {0, 2, 3, 4, 8, 11}),
-    ("B T5I", {0, 1, 3, 4, 5, 9}),
-    ("B T6I", {1, 2, 4, 5, 6, 10}),
-    ("B T7I", {2, 3, 5, 6, 7, 11}),
-    ("B T8I", {0, 3, 4, 6, 7, 8}),
-    ("B T9I", {1, 4, 5, 7, 8, 9}),
-    ("B T10I", {2, 5, 6, 8, 9, 10}),
-    ("B T11I", {3, 6, 7, 9, 10, 11})
-]
-
-card7 = []
-card8 = []
-card9 = []
-card10 = []
-
-# produce all combinations
-for tup1 in sets:
-    for tup2 in sets:
-        newset = tup1[1].union(tup2[1])
-        if len(newset) == 7:
-            card7.append((f"{tup1[0]} U {tup2[0]}", newset))
-        if len(newset) == 8:
-            card8.append((f"{tup1[0]} U {tup2[0]}", newset))
-        if len(newset) == 9:
-            card9.append((f"{tup1[0]} U {tup2[0]}", newset))
-        if len(newset) == 10:
-            card10.append((f"{tup1[0]} U {tup2[0]}", newset))
-
-# remove duplicates
-for i in range(len(card9)):
-    if i < len(card9):
-        for j in range(i + 1, len(card9)):
-            while j < len(card9) and card9[i][1] == card9[j][1]:
-                del card9[j]
-
-# display results
-for item in card9:
-    print(item)
\ No newline at end of file
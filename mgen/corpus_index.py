@@ -0,0 +1,271 @@
+"""
+File: corpus_index.py
+Author: Jeff Martin
+Email: jeffreymartin@outlook.com
+This file contains an index for searching a corpus of pcsets. The corpus is stored as a table with a slot
+for every pcset mask, so insertion and membership tests are constant time and duplicates collapse.
+Superset counts come from a superset-sum transform of that table, and subset and superset queries look up
+the submasks or supermasks of each query in it. It also contains a cached corpus provider, which makes the
+corpus of every form of a set class under an operator group.
+Copyright © 2022 by Jeff Martin. All rights reserved.
+"""
+
+import functools
+import numpy as np
+import os
+from .set_class_table import count_bits, get_mask, get_pcset, get_submasks, invert_masks, rotate_masks
+
+# The operator groups for corpus generation
+OPERATOR_GROUPS = ["Tn", "TnI", "TnIM"]
+
+
+class CorpusIndex:
+    """
+    Indexes a corpus of pcsets for subset, superset, and common-tone queries. Pcsets can be added at any time.
+    Query results are arrays of the masks of the matching members, in ascending order.
+    """
+    def __init__(self, pcsets=None, edo=12):
+        """
+        Creates a CorpusIndex
+        :param pcsets: An optional list of pcsets (of integers or PitchClass objects) or masks to add
+        :param edo: The number of divisions of the octave. The index has 2^edo slots, so it is meant for 12-EDO.
+        """
+        self.edo = edo
+        self.present = np.zeros(1 << edo, dtype=bool)  # mask -> whether the pcset is in the corpus
+        self._members = None                           # cached array of member masks
+        self._superset_counts = None                   # cached table of superset counts (see get_superset_counts)
+        if pcsets is not None:
+            self.add_many(pcsets)
+
+    def __contains__(self, pcset):
+        return bool(self.present[self.to_mask(pcset)])
+
+    def __len__(self):
+        return len(self.get_members())
+
+    def add(self, pcset):
+        """
+        Adds a pcset to the corpus
+        :param pcset: A pcset or mask
+        :return:
+        """
+        self.present[self.to_mask(pcset)] = True
+        self._members = None
+        self._superset_counts = None
+
+    def add_many(self, pcsets):
+        """
+        Adds pcsets to the corpus
+        :param pcsets: A list of pcsets or masks, or an array of masks
+        :return:
+        """
+        if type(pcsets) == np.ndarray:
+            self.present[pcsets] = True
+        else:
+            self.present[[self.to_mask(pcset) for pcset in pcsets]] = True
+        self._members = None
+        self._superset_counts = None
+
+    def count_supersets(self, queries):
+        """
+        Counts the members that contain each query (including the query itself). Each count is a single
+        lookup in the superset count table.
+        :param queries: A list of pcsets or masks
+        :return: An array of counts, one for each query
+        """
+        return self.get_superset_counts()[[self.to_mask(query) for query in queries]]
+
+    def get_members(self):
+        """
+        Gets the corpus members
+        :return: An array of masks
+        """
+        if self._members is None:
+            self._members = np.nonzero(self.present)[0].astype(np.int32)
+        return self._members
+
+    def get_sharing(self, queries, k):
+        """
+        Finds the members that share at least k pcs with each query. Each query is compared with every member.
+        :param queries: A list of pcsets or masks
+        :param k: The minimum number of common pcs
+        :return: A list of arrays of masks, one for each query
+        """
+        members = self.get_members()
+        query_masks = np.array([self.to_mask(query) for query in queries], dtype=np.int32).reshape((-1, 1))
+        hits = count_bits(members.reshape((1, -1)) & query_masks) >= k
+        return [members[row] for row in hits]
+
+    def get_subsets(self, queries):
+        """
+        Finds the members that are contained in each query (including the query itself). The submasks of
+        each query are looked up in the presence table, unless the query has more submasks than the corpus
+        has members, in which case the members are scanned instead.
+        :param queries: A list of pcsets or masks
+        :return: A list of arrays of masks, one for each query
+        """
+        results = []
+        for query in queries:
+            mask = self.to_mask(query)
+            if 1 << mask.bit_count() <= len(self):
+                submasks = np.array(get_submasks(mask)[::-1], dtype=np.int32)
+                results.append(submasks[self.present[submasks]])
+            else:
+                members = self.get_members()
+                results.append(members[(members & ~mask) == 0])
+        return results
+
+    def get_superset_counts(self):
+        """
+        Gets the superset count table. Slot m holds the number of members that contain the pcset with mask m.
+        The table is built from the presence table with a superset-sum transform, which adds the count of
+        each mask with a pc to the same mask without it, one pc at a time.
+        :return: An array of 2^edo counts
+        """
+        if self._superset_counts is None:
+            counts = self.present.astype(np.int32)
+            for pc in range(self.edo):
+                slots = counts.reshape((-1, 2, 1 << pc))
+                slots[:, 0, :] += slots[:, 1, :]
+            self._superset_counts = counts
+        return self._superset_counts
+
+    def get_supersets(self, queries):
+        """
+        Finds the members that contain each query (including the query itself). Queries that no member
+        contains are answered from the superset count table. Otherwise the supermasks of the query are looked
+        up in the presence table, unless the query has more supermasks than the corpus has members, in which
+        case the members are scanned instead.
+        :param queries: A list of pcsets or masks
+        :return: A list of arrays of masks, one for each query
+        """
+        counts = self.get_superset_counts()
+        full = (1 << self.edo) - 1
+        results = []
+        for query in queries:
+            mask = self.to_mask(query)
+            if counts[mask] == 0:
+                results.append(np.zeros(0, dtype=np.int32))
+            elif 1 << (self.edo - mask.bit_count()) <= len(self):
+                supermasks = mask | np.array(get_submasks(full & ~mask)[::-1], dtype=np.int32)
+                results.append(supermasks[self.present[supermasks]])
+            else:
+                members = self.get_members()
+                results.append(members[(members & mask) == mask])
+        return results
+
+    def sharing(self, pcset, k):
+        """
+        Finds the members that share at least k pcs with a pcset
+        :param pcset: A pcset or mask
+        :param k: The minimum number of common pcs
+        :return: An array of masks
+        """
+        return self.get_sharing([pcset], k)[0]
+
+    def subsets(self, pcset):
+        """
+        Finds the members that are contained in a pcset
+        :param pcset: A pcset or mask
+        :return: An array of masks
+        """
+        return self.get_subsets([pcset])[0]
+
+    def supersets(self, pcset):
+        """
+        Finds the members that contain a pcset
+        :param pcset: A pcset or mask
+        :return: An array of masks
+        """
+        return self.get_supersets([pcset])[0]
+
+    @staticmethod
+    def to_mask(pcset):
+        """
+        Gets the mask of a pcset, or passes a mask through
+        :param pcset: A pcset or mask
+        :return: The mask
+        """
+        return int(pcset) if type(pcset) == int or isinstance(pcset, np.integer) else get_mask(pcset)
+
+    def to_pcsets(self, masks):
+        """
+        Converts query results to pcsets
+        :param masks: An array of masks
+        :return: A list of pcsets of integers
+        """
+        return [get_pcset(int(mask), self.edo) for mask in masks]
+
+
+def get_corpus(pcset, edo=12, group="TnI", cache_dir=None):
+    """
+    Gets the corpus of every form of a pcset under an operator group. Corpora are cached by prime form, EDO, and
+    operator group in memory, and optionally on disk.
+    :param pcset: A pcset (of integers or PitchClass objects) or mask
+    :param edo: The number of divisions of the octave
+    :param group: The operator group: "Tn", "TnI", or "TnIM" (TnI plus multiplication by edo / 2 - 1, such as
+    M5 and M7 in 12-EDO)
+    :param cache_dir: A directory for saved corpora. If None, corpora are only cached in memory.
+    :return: A read-only sorted array of the masks of the forms
+    """
+    mask = CorpusIndex.to_mask(pcset)
+    return load_corpus(int(get_forms(mask, edo, group).min()), edo, group, cache_dir)
+
+
+def get_corpus_union(pcsets, edo=12, group="TnI", cache_dir=None):
+    """
+    Gets the union of the corpora of several pcsets
+    :param pcsets: A list of pcsets or masks
+    :param edo: The number of divisions of the octave
+    :param group: The operator group (see get_corpus)
+    :param cache_dir: A directory for saved corpora
+    :return: A sorted array of masks
+    """
+    if len(pcsets) == 0:
+        return np.zeros(0, dtype=np.int32)
+    return np.unique(np.concatenate([get_corpus(pcset, edo, group, cache_dir) for pcset in pcsets]))
+
+
+def get_forms(mask, edo, group):
+    """
+    Gets every form of a mask under an operator group
+    :param mask: The mask
+    :param edo: The number of divisions of the octave
+    :param group: The operator group
+    :return: An array of masks, possibly with duplicates
+    """
+    if group not in OPERATOR_GROUPS:
+        raise ValueError(f"Unknown operator group {group}. The operator groups are {OPERATOR_GROUPS}.")
+    sources = [np.array([mask], dtype=np.int64)]
+    if group != "Tn":
+        sources.append(invert_masks(sources[0], edo))
+    if group == "TnIM":
+        multiplier = edo // 2 - 1
+        sources.append(np.array([get_mask({(pc * multiplier) % edo for pc in get_pcset(mask, edo)})], dtype=np.int64))
+        sources.append(invert_masks(sources[-1], edo))
+    sources = np.concatenate(sources)
+    return np.concatenate([rotate_masks(sources, n, edo) for n in range(edo)])
+
+
+@functools.lru_cache(maxsize=1024)
+def load_corpus(prime_form, edo, group, cache_dir):
+    """
+    Makes or loads the corpus of a prime form
+    :param prime_form: The prime form mask under the operator group
+    :param edo: The number of divisions of the octave
+    :param group: The operator group
+    :param cache_dir: A directory for saved corpora, or None
+    :return: A read-only sorted array of masks
+    """
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, f"corpus{edo}_{group}_{prime_form}.npy")
+    if path is not None and os.path.exists(path):
+        corpus = np.load(path)
+    else:
+        corpus = np.unique(get_forms(prime_form, edo, group)).astype(np.int32)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(path, corpus)
+    corpus.flags.writeable = False
+    return corpus
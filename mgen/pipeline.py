@@ -0,0 +1,183 @@
+"""
+File: pipeline.py
+Author: Jeff Martin
+Email: jeffreymartin@outlook.com
+This file contains functionality for running post-processing passes over parsed parts as a pipeline of stages,
+with timing and memory instrumentation for each stage.
+Copyright © 2022 by Jeff Martin. All rights reserved.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import time
+import tracemalloc
+
+
+class Stage:
+    """
+    Represents a stage in a Pipeline
+    """
+    def __init__(self, **kwargs):
+        self.args = kwargs["args"] if "args" in kwargs else ()                  # extra positional arguments
+        self.function = kwargs["function"] if "function" in kwargs else None    # function(new_parts, *args, **kwargs)
+        self.kwargs = kwargs["kwargs"] if "kwargs" in kwargs else {}            # extra keyword arguments
+        self.name = kwargs["name"] if "name" in kwargs else ""                  # stage name for the profile report
+        self.voices = kwargs["voices"] if "voices" in kwargs else None          # (part, voice) indices touched
+
+
+class Pipeline:
+    """
+    Represents an ordered sequence of stages that process a list of parsed parts in place. Each stage records its
+    wall time in the profile, and optionally the peak memory allocated while it runs.
+
+    A stage may declare the (part, voice) indices it touches, meaning every voice it reads or modifies. Consecutive
+    stages that declare disjoint voices can run in parallel. The stages are CPU-bound Python, so parallel stages run
+    in worker processes: each worker gets a copy of the parts that holds only its stage's voices (the other voices
+    are empty), and the voices it returns replace the contents of the original voices, so references to the old
+    objects in those voices go stale. The function and arguments of a parallel stage must therefore be picklable
+    (for example, module-level functions). Starting the workers and pickling the voices both ways costs tens of
+    milliseconds, so only declare voices for stages that take much longer than that; light stages are faster
+    run alone. Stages that do not declare their voices are assumed to touch everything and run alone, in this
+    process.
+    """
+    def __init__(self, trace_memory=False):
+        """
+        Creates a Pipeline
+        :param trace_memory: Whether or not to measure peak memory for each stage. Tracing slows stages down,
+        which inflates their timings, and it only covers stages that run in this process.
+        """
+        self.group_times = []       # the wall time of each group of stages in the last run
+        self.profile = []           # one record per stage run: name, group, seconds, peak_memory
+        self.stages = []            # the stages, in order
+        self.trace_memory = trace_memory
+
+    def add_stage(self, name, function, *args, voices=None, **kwargs):
+        """
+        Adds a stage to the end of the pipeline
+        :param name: The stage name
+        :param function: A function that takes the parsed parts as its first argument
+        :param args: Extra positional arguments for the function
+        :param voices: An optional collection of (part, voice) index tuples that the stage touches
+        :param kwargs: Extra keyword arguments for the function
+        :return: The Stage
+        """
+        stage = Stage(name=name, function=function, args=args, kwargs=kwargs,
+                      voices=frozenset(voices) if voices is not None else None)
+        self.stages.append(stage)
+        return stage
+
+    def get_groups(self):
+        """
+        Groups consecutive stages that touch disjoint voices, so each group can run in parallel
+        :return: A list of lists of Stages
+        """
+        groups = []
+        group_voices = set()
+        for stage in self.stages:
+            if len(groups) > 0 and stage.voices is not None and groups[-1][-1].voices is not None and \
+                    group_voices.isdisjoint(stage.voices):
+                groups[-1].append(stage)
+                group_voices.update(stage.voices)
+            else:
+                groups.append([stage])
+                group_voices = set(stage.voices) if stage.voices is not None else set()
+        return groups
+
+    def report(self):
+        """
+        Makes a profile report of the last run, with the slowest stages first. Stages in a parallel group overlap,
+        so the wall time of the run can be less than the total of the stage times.
+        :return: The report as a string
+        """
+        total = sum(record["seconds"] for record in self.profile)
+        lines = ["{0: <40}{1: >7}{2: >12}{3: >8}{4: >16}".format("stage", "group", "seconds", "%", "peak memory")]
+        for record in sorted(self.profile, key=lambda r: r["seconds"], reverse=True):
+            lines.append("{0: <40}{1: >7}{2: >12}{3: >8}{4: >16}".format(
+                record["name"], record["group"], round(record["seconds"], 4),
+                round(100 * record["seconds"] / total, 1) if total > 0 else 0,
+                record["peak_memory"] if record["peak_memory"] is not None else "-"))
+        lines.append("{0: <40}{1: >7}{2: >12}".format("total", "", round(total, 4)))
+        lines.append("{0: <40}{1: >7}{2: >12}".format("wall time", "", round(sum(self.group_times), 4)))
+        return "\n".join(lines)
+
+    def run(self, new_parts, max_workers=1):
+        """
+        Runs the pipeline on a list of parsed parts
+        :param new_parts: A list of parsed parts
+        :param max_workers: The number of processes for running stages in parallel. If 1, every stage runs alone
+        in this process.
+        :return: The profile
+        """
+        self.group_times = []
+        self.profile = []
+        groups = self.get_groups() if max_workers > 1 else [[stage] for stage in self.stages]
+        started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        executor = None
+        try:
+            for g, group in enumerate(groups):
+                start = time.perf_counter()
+                peak_memory = None
+                if len(group) == 1:
+                    if self.trace_memory:
+                        tracemalloc.reset_peak()
+                        base_memory = tracemalloc.get_traced_memory()[0]
+                    records = [run_stage(group[0], new_parts)]
+                    if self.trace_memory:
+                        peak_memory = tracemalloc.get_traced_memory()[1] - base_memory
+                else:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(max_workers=max_workers)
+                    futures = [executor.submit(run_stage_voices, stage, get_voice_subset(new_parts, stage.voices))
+                               for stage in group]
+                    records = []
+                    for future in futures:
+                        record, voices = future.result()
+                        for (p, v), voice in voices.items():
+                            new_parts[p][v][:] = voice
+                        records.append(record)
+                self.group_times.append(time.perf_counter() - start)
+                for record in records:
+                    record["group"] = g
+                    record["peak_memory"] = peak_memory
+                    self.profile.append(record)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if started_tracing:
+                tracemalloc.stop()
+        return self.profile
+
+
+def get_voice_subset(new_parts, voices):
+    """
+    Copies the structure of a list of parsed parts, keeping only some of the voices. The other voices are empty.
+    :param new_parts: A list of parsed parts
+    :param voices: A collection of (part, voice) index tuples to keep
+    :return: A list of parts
+    """
+    return [[voice if (p, v) in voices else [] for v, voice in enumerate(part)] for p, part in enumerate(new_parts)]
+
+
+def run_stage(stage, new_parts):
+    """
+    Runs a single stage and times it
+    :param stage: The Stage
+    :param new_parts: A list of parsed parts
+    :return: A profile record
+    """
+    start = time.perf_counter()
+    stage.function(new_parts, *stage.args, **stage.kwargs)
+    return {"name": stage.name, "seconds": time.perf_counter() - start}
+
+
+def run_stage_voices(stage, new_parts):
+    """
+    Runs a single stage in a worker process
+    :param stage: The Stage
+    :param new_parts: A list of parsed parts (see get_voice_subset)
+    :return: A profile record, and a dictionary of (part, voice) -> the voice after the stage ran
+    """
+    record = run_stage(stage, new_parts)
+    return record, {(p, v): new_parts[p][v] for p, v in stage.voices}
@@ -0,0 +1,101 @@
+"""
+File: sample_map.py
+Author: Jeff Martin
+Email: jeffreymartin@outlook.com
+This file contains functionality for choosing sample buffers for notes in sampled instruments.
+Copyright © 2022 by Jeff Martin. All rights reserved.
+"""
+
+import bisect
+import numpy as np
+
+
+class SampleMap:
+    """
+    Represents a sampled instrument as a sorted list of the pitches of its buffers. A lookup table maps every
+    pitch in the range of the instrument to its buffer, so whole voices can be assigned at once.
+    """
+    def __init__(self, pitches, tolerance=2):
+        """
+        Creates a SampleMap
+        :param pitches: The pitch integer of each buffer, in ascending order
+        :param tolerance: The largest distance between a pitch and a buffer's pitch for the buffer to be used
+        """
+        self.pitches = list(pitches)
+        self.tolerance = tolerance
+        self.low = self.pitches[0]
+        self.high = self.pitches[-1]
+
+        # For each pitch in the range, use the highest buffer within the tolerance (-1 if there is none)
+        self.table = np.full(self.high - self.low + 1, -1, dtype=int)
+        for p in range(self.low, self.high + 1):
+            i = bisect.bisect_right(self.pitches, p + tolerance) - 1
+            if i >= 0 and self.pitches[i] >= p - tolerance:
+                self.table[p - self.low] = i
+
+    def assign_buffers(self, notes, short_duration=0.5, short_spread=3, num_buffers=None, rng=None):
+        """
+        Assigns buffers to a list of Notes. Notes shorter than short_duration get a random buffer, chosen
+        from short_spread buffers below their own buffer up to the second-highest buffer.
+        :param notes: A list of Notes
+        :param short_duration: The duration below which a note is considered short
+        :param short_spread: How many buffers below its own buffer a short note may use
+        :param num_buffers: The number of buffers available for short notes (defaults to the size of the map)
+        :param rng: A NumPy random Generator, so the short-note choices can be seeded
+        :return:
+        """
+        if len(notes) == 0:
+            return
+        if num_buffers is None:
+            num_buffers = len(self.pitches)
+        if rng is None:
+            rng = np.random.default_rng()
+        buffers = self.lookup([note.pitch.p for note in notes], [note.buffer for note in notes])
+        durations = np.array([float(note.duration) for note in notes])
+        short = durations < short_duration
+        if np.any(short):
+            lower = np.maximum(0, np.array(buffers, dtype=int)[short] - short_spread)
+            short_buffers = rng.integers(lower, num_buffers - 1).tolist()
+            for i, j in enumerate(np.nonzero(short)[0].tolist()):
+                buffers[j] = short_buffers[i]
+        for note, buffer in zip(notes, buffers):
+            note.buffer = buffer
+
+    def lookup(self, pitches, current=None):
+        """
+        Looks up the buffer for each pitch. Pitches below or above the map use the lowest or highest buffer.
+        :param pitches: A list of pitch integers
+        :param current: The current buffer for each pitch, which is kept if no buffer is within the tolerance
+        :return: A list of buffer indices
+        """
+        if current is None:
+            current = [0 for p in pitches]
+        pitches = np.asarray(pitches)
+        clipped = np.clip(np.round(pitches).astype(int), self.low, self.high)
+        buffers = self.table[clipped - self.low]
+        buffers = np.where(pitches < self.low, 0, buffers)
+        buffers = np.where(pitches > self.high, len(self.pitches) - 1, buffers)
+        result = buffers.tolist()
+        for i in range(len(result)):
+            # Pitches between table entries (such as microtones off the grid) are matched directly
+            if pitches[i] != clipped[i] and self.low <= pitches[i] <= self.high:
+                result[i] = self.lookup_pitch(float(pitches[i]), current[i])
+            elif result[i] == -1:
+                result[i] = current[i]
+        return result
+
+    def lookup_pitch(self, p, current=0):
+        """
+        Looks up the buffer for a single pitch
+        :param p: A pitch
+        :param current: The current buffer, which is kept if no buffer is within the tolerance
+        :return: A buffer index
+        """
+        if p < self.low:
+            return 0
+        elif p > self.high:
+            return len(self.pitches) - 1
+        i = bisect.bisect_right(self.pitches, p + self.tolerance) - 1
+        if i >= 0 and self.pitches[i] >= p - self.tolerance:
+            return i
+        return current
@@ -0,0 +1,126 @@
+"""
+File: sc_effects.py
+Author: Jeff Martin
+Email: jeffreymartin@outlook.com
+This file contains functionality for placing effects (dynamics, pans, etc.) on parsed parts for a SuperCollider piece.
+Copyright © 2022 by Jeff Martin. All rights reserved.
+"""
+
+from . import xml_parse_sc
+from .xml_parse_sc import Dynamic, Note, Pan, Sound
+
+
+def collapse_voices(new_parts):
+    """
+    Collapses separately chained entries (see place_effects) in a list of parts. Each voice is rebuilt
+    in a single pass, and the new list replaces the contents of the old one.
+    :param new_parts: A list of parts
+    :return: None
+    """
+    for part in new_parts:
+        for voice in part:
+            collapsed = []
+            for item in voice:
+                if type(item) == list:
+                    collapsed.extend(item)
+                else:
+                    collapsed.append(item)
+            voice[:] = collapsed
+
+
+def get_sound_event(item):
+    """
+    Gets the Note or Sound for an entry in a voice. If effects have been chained onto the entry,
+    the entry is a list and the Note or Sound is found inside it.
+    :param item: An entry in a voice
+    :return: The Note or Sound, or None if a chained entry does not contain one
+    """
+    if type(item) == list:
+        for item2 in item:
+            if type(item2) == Note or type(item2) == Sound:
+                return item2
+        return None
+    return item
+
+
+def place_effects(new_parts, effect_parts, change_bus_constant, end_time_padding=0.05, index=None):
+    """
+    Places effects (Dynamics, Effects, and Pans) on a list of parsed parts and updates buses. The first note
+    affected by each effect is found with a time index rather than by scanning the voice.
+
+    Effects are added with separate chaining: the entry of the starting note becomes a list containing the
+    effect(s) and the note, so every other entry keeps its offset. Use collapse_voices afterward to flatten
+    the voices. Dynamics are duplicated onto the neighboring bus, because adjacent notes alternate buses to
+    allow legato.
+    :param new_parts: A list of parsed parts
+    :param effect_parts: A list of effects, in the order they should be placed
+    :param change_bus_constant: The offset between the bus of a note and the input bus of an effect
+    :param end_time_padding: The time added to the end of the ending note of an effect
+    :param index: An index of the parts (see xml_parse_sc.index_parts). If None, it will be built.
+    :return:
+    """
+    if index is None:
+        index = xml_parse_sc.index_parts(new_parts)
+
+    for effect in effect_parts:
+        start_entry = new_parts[effect.start_note[0]][effect.start_note[1]]
+        start_note = get_sound_event(start_entry[effect.start_note[2]])
+
+        # Pan effects are easy to add
+        if type(effect) == Pan:
+            effect.bus_in = start_note.bus_out
+            effect.duration = start_note.duration
+            effect.measure = start_note.measure
+            effect.start_time = start_note.start_time
+
+        # For normal effects, we need to update buses, etc.
+        else:
+            end_note = get_sound_event(new_parts[effect.end_note[0]][effect.end_note[1]][effect.end_note[2]])
+
+            # Set times and duration
+            effect.start_time = start_note.start_time
+            effect.end_time = end_note.start_time + end_note.duration + end_time_padding
+            effect.measure = start_note.measure
+            effect.duration = effect.end_time - effect.start_time
+
+            # The bus for the effect comes from the first note that lies entirely within the effect
+            voice = new_parts[effect.voice_index[0]][effect.voice_index[1]]
+            first_idx = index[effect.voice_index[0]][effect.voice_index[1]].first_within(voice, effect.start_time,
+                                                                                          effect.end_time)
+            if first_idx is None:
+                first_idx = 0
+                effect.bus_out = -1
+            else:
+                effect.bus_out = get_sound_event(voice[first_idx]).bus_out
+            effect.bus_in = effect.bus_out - change_bus_constant
+
+            # Update the buses of affected notes
+            for i in range(first_idx, len(voice)):
+                item = get_sound_event(voice[i])
+                if item is None:
+                    continue
+                if item.start_time > effect.end_time or item.end_time > effect.end_time + end_time_padding:
+                    break
+                item.bus_out -= change_bus_constant
+
+        # Now we need to duplicate the effect to deal with the alternating buses in adjacent notes,
+        # a feature we implemented to allow legato. At this point, only dynamics are duplicated.
+        chained = [effect]
+        if type(effect) == Dynamic:
+            effect2 = Dynamic(synth=effect.synth, start_note=effect.start_note, end_note=effect.end_note,
+                              voice_index=effect.voice_index, levels=effect.levels, times=effect.times,
+                              curves=effect.curves, duration=effect.duration, start_time=effect.start_time,
+                              end_time=effect.end_time, measure=effect.measure)
+            if effect.bus_in % 2 == 0:
+                effect2.bus_in = effect.bus_in + 1
+                effect2.bus_out = effect.bus_out + 1
+            else:
+                effect2.bus_in = effect.bus_in - 1
+                effect2.bus_out = effect.bus_out - 1
+            chained.append(effect2)
+
+        # Chain the effect(s) in front of the starting note
+        if type(start_entry[effect.start_note[2]]) == list:
+            start_entry[effect.start_note[2]][0:0] = chained
+        else:
+            start_entry[effect.start_note[2]] = chained + [start_entry[effect.start_note[2]]]
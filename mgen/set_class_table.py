@@ -0,0 +1,384 @@
+"""
+File: set_class_table.py
+Author: Jeff Martin
+Email: jeffreymartin@outlook.com
+This file contains lookup tables for set classes. A pcset is represented as an integer mask, where
+bit n is set if pitch class n is in the pcset, so a table with one entry per mask covers every pcset.
+The 12-EDO table has 4096 entries. It is built on first use and saved to a compressed file, which
+later runs load directly. Tables for other EDOs (such as 24-EDO, with 16,777,216 entries) are built on
+demand, saved to disk, and memory-mapped.
+Copyright © 2022 by Jeff Martin. All rights reserved.
+"""
+
+import functools
+import numpy as np
+import os
+import shutil
+
+# The directory for saved tables
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".mgen_cache")
+
+# The number of masks to process at once when building a table
+CHUNK_SIZE = 1 << 20
+
+TABLE_ARRAYS = ["prime_form", "set_class", "transformation", "ic_vector", "prime_forms"]
+
+
+class SetClassTable:
+    """
+    Maps every pcset mask in an EDO to its set class. For each mask, the table holds the prime form,
+    the set-class id, the transformation level, and the interval-class vector. The transformation level
+    is n if the pcset is Tn of the prime form, and edo + n if it is TnI of the prime form. In 12-EDO,
+    set-class ids follow Forte order, so an id is also the index of the set class's Forte name in names.
+    In other EDOs, ids are ordered by cardinality and then by prime form.
+    """
+    def __init__(self, **kwargs):
+        """
+        Creates a SetClassTable. Use get_table() rather than calling this directly.
+        :param kwargs: edo, prime_form, set_class, transformation, ic_vector, prime_forms, names
+        """
+        self.edo = kwargs["edo"] if "edo" in kwargs else 12
+        self.prime_form = kwargs["prime_form"] if "prime_form" in kwargs else None          # mask -> prime form mask
+        self.set_class = kwargs["set_class"] if "set_class" in kwargs else None            # mask -> set-class id
+        self.transformation = kwargs["transformation"] if "transformation" in kwargs else None  # mask -> level
+        self.ic_vector = kwargs["ic_vector"] if "ic_vector" in kwargs else None            # mask -> ic vector
+        self.prime_forms = kwargs["prime_forms"] if "prime_forms" in kwargs else None      # id -> prime form mask
+        self.names = kwargs["names"] if "names" in kwargs else None                        # id -> Forte name
+
+    def filter(self, masks, set_classes):
+        """
+        Finds which pcset masks belong to any of a group of set classes
+        :param masks: An array of masks
+        :param set_classes: A list of set-class ids, Forte names, or pcsets (see get_set_class_id)
+        :return: A boolean array
+        """
+        ids = [self.get_set_class_id(item) for item in set_classes]
+        return np.isin(self.set_class[np.asarray(masks)], ids)
+
+    def find_subsets(self, parents, set_classes):
+        """
+        Finds the subsets of each parent pcset that belong to a group of set classes. Subsets are
+        enumerated as submasks of each parent mask.
+        :param parents: A list of parent pcsets of integers, or masks
+        :param set_classes: A list of set-class ids, Forte names, prime forms, or pcsets (see get_set_class_id)
+        :return: A list with a dictionary for each parent, mapping each item of set_classes to an array
+        of the subset masks in that set class
+        """
+        ids = np.array([self.get_set_class_id(item) for item in set_classes])
+        results = []
+        for parent in parents:
+            mask = parent if type(parent) == int else get_mask(parent)
+
+            # Every nonempty submask of the parent, from largest to smallest
+            submasks = np.array(get_submasks(mask)[:-1], dtype=np.int32)
+            classes = self.set_class[submasks]
+            results.append({set_classes[i]: submasks[classes == ids[i]] for i in range(len(ids))})
+        return results
+
+    def get_set_class_id(self, item):
+        """
+        Gets a set-class id
+        :param item: A set-class id, a Forte name such as "3-11" (12-EDO only), a prime form such as "[037]"
+        (12-EDO only, with A and B for 10 and 11), or a pcset of integers
+        :return: The set-class id
+        """
+        if type(item) == int:
+            return item
+        elif type(item) == str and item.startswith("["):
+            return int(self.set_class[get_mask([int(pc, 16) for pc in item.strip("[]")])])
+        elif type(item) == str:
+            return self.names.index(item)
+        return int(self.set_class[get_mask(item)])
+
+
+def build_table(edo, arrays):
+    """
+    Fills the arrays of a set-class table
+    :param edo: The number of divisions of the octave
+    :param arrays: A dictionary of the per-mask arrays prime_form, set_class, transformation,
+    and ic_vector to fill
+    :return: An array of the prime form of each set-class id
+    """
+    size = 1 << edo
+    for start in range(0, size, CHUNK_SIZE):
+        masks = np.arange(start, min(start + CHUNK_SIZE, size), dtype=np.int64)
+        prime_form, level = find_prime_forms(masks, edo)
+        arrays["prime_form"][start:start + len(masks)] = prime_form
+        arrays["transformation"][start:start + len(masks)] = level
+        arrays["ic_vector"][start:start + len(masks)] = get_ic_vectors(masks, edo)
+
+    # Number the set classes by cardinality, then by prime form
+    unique = np.unique(arrays["prime_form"])
+    order = np.lexsort((unique, count_bits(unique)))
+    ids = np.empty(len(unique), dtype=np.int32)
+    ids[order] = np.arange(len(unique), dtype=np.int32)
+    for start in range(0, size, CHUNK_SIZE):
+        arrays["set_class"][start:start + CHUNK_SIZE] = \
+            ids[np.searchsorted(unique, arrays["prime_form"][start:start + CHUNK_SIZE])]
+    return unique[order]
+
+
+def count_bits(masks):
+    """
+    Counts the pitch classes in an array of masks
+    :param masks: An array of masks
+    :return: An array of counts
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(masks).astype(np.int64)
+    counts = np.zeros(masks.shape, dtype=np.int64)
+    masks = masks.copy()
+    while np.any(masks):
+        counts += masks & 1
+        masks >>= 1
+    return counts
+
+
+def find_prime_forms(masks, edo=12):
+    """
+    Finds the prime form of each mask in an array, and the transformation level that leads to it
+    :param masks: An array of masks
+    :param edo: The number of divisions of the octave
+    :return: An array of prime form masks and an array of transformation levels (see SetClassTable)
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    inverted = invert_masks(masks, edo)
+
+    # Find the smallest transposition or inversion
+    prime_form = masks.copy()
+    level = np.zeros(len(masks), dtype=np.int16)
+    for n in range(edo):
+        for source, level_n in ((masks, n), (inverted, edo + (-n) % edo)):
+            if source is masks and n == 0:
+                continue
+            rotated = rotate_masks(source, n, edo)
+            smaller = rotated < prime_form
+            prime_form[smaller] = rotated[smaller]
+            level[smaller] = level_n
+    return prime_form, level
+
+
+def get_dsym(mask, edo=12):
+    """
+    Gets the degree of symmetry of a pcset (the number of Tn and TnI forms that map it onto itself)
+    :param mask: The mask
+    :param edo: The number of divisions of the octave
+    :return: The degree of symmetry
+    """
+    inverted = invert_masks(mask, edo)
+    return sum((rotate_masks(mask, n, edo) == mask) + (rotate_masks(inverted, n, edo) == mask) for n in range(edo))
+
+
+def get_forte_names(prime_forms):
+    """
+    Gets the Forte names of 12-EDO set classes from the pctheory set-class tables
+    :param prime_forms: An array of prime form masks
+    :return: A list of Forte names
+    """
+    from pctheory import tables
+    x = tables.create_tables_sc12() if hasattr(tables, "create_tables_sc12") else tables.create_tables()
+    return [x["setToForteNameTable"]["[" + "".join(x["hexChars"][pc] for pc in sorted(get_pcset(int(mask))))
+                                      + "]"] for mask in prime_forms]
+
+
+def get_ic_vectors(masks, edo=12):
+    """
+    Gets the interval-class vector of each mask in an array. The tritone (or other half-octave interval)
+    is only counted once per pair of pitch classes.
+    :param masks: An array of masks
+    :param edo: The number of divisions of the octave
+    :return: An array with a row for each mask
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    ic_vectors = np.empty((len(masks), edo // 2), dtype=np.uint8)
+    for interval in range(1, edo // 2 + 1):
+        count = count_bits(masks & rotate_masks(masks, interval, edo))
+        if interval * 2 == edo:
+            count //= 2
+        ic_vectors[:, interval - 1] = count
+    return ic_vectors
+
+
+def get_mask(pcset):
+    """
+    Gets the integer mask of a pcset
+    :param pcset: A pcset of integers or PitchClass objects
+    :return: The mask
+    """
+    mask = 0
+    for pc in pcset:
+        mask |= 1 << (pc.pc if hasattr(pc, "pc") else pc)
+    return mask
+
+
+def get_pcset(mask, edo=12):
+    """
+    Gets the pcset of an integer mask
+    :param mask: The mask
+    :param edo: The number of divisions of the octave
+    :return: A pcset of integers
+    """
+    return {pc for pc in range(edo) if mask & (1 << pc)}
+
+
+def get_prime_forms(edo=12):
+    """
+    Gets a table of the prime form of every pcset. Prime forms are in Rahn form, which is the
+    transposition or inversion with the smallest mask.
+    :param edo: The number of divisions of the octave
+    :return: An array with the prime form mask of each pcset mask
+    """
+    return get_table(edo).prime_form
+
+
+@functools.lru_cache(maxsize=4096)
+def get_set_class_info(mask, edo=12):
+    """
+    Gets information about the set class of a pcset. 12-EDO results are read from the set-class table,
+    and results for other EDOs are calculated directly, so that the large tables are not needed.
+    :param mask: The mask
+    :param edo: The number of divisions of the octave
+    :return: The prime form mask, the Forte name (None outside of 12-EDO), the IC vector as a tuple,
+    and the degree of symmetry
+    """
+    if edo == 12:
+        table = get_table(edo)
+        prime_form = int(table.prime_form[mask])
+        name = table.names[table.set_class[mask]]
+        ic_vector = table.ic_vector[mask]
+    else:
+        prime_form = int(find_prime_forms([mask], edo)[0][0])
+        name = None
+        ic_vector = get_ic_vectors([mask], edo)[0]
+    return prime_form, name, tuple(int(count) for count in ic_vector), get_dsym(mask, edo)
+
+
+@functools.lru_cache(maxsize=4096)
+def get_submasks(mask):
+    """
+    Gets every submask of a mask (the masks of all subsets of a pcset), including the empty set
+    :param mask: The mask
+    :return: A tuple of submasks, from largest to smallest
+    """
+    submasks = []
+    s = mask
+    while s > 0:
+        submasks.append(s)
+        s = (s - 1) & mask
+    submasks.append(0)
+    return tuple(submasks)
+
+
+@functools.lru_cache(maxsize=4096)
+def get_subset_classes(mask, edo=12):
+    """
+    Gets the set classes of all subsets of a pcset, including the empty set and the pcset itself
+    :param mask: The mask
+    :param edo: The number of divisions of the octave
+    :return: A tuple of prime form masks. In 12-EDO, they are in Forte order. In other EDOs, they are
+    ordered by cardinality and then by prime form.
+    """
+    submasks = np.array(get_submasks(mask), dtype=np.int64)
+    if edo == 12:
+        table = get_table(edo)
+        return tuple(int(prime_form) for prime_form in table.prime_forms[np.unique(table.set_class[submasks])])
+    prime_forms = np.unique(find_prime_forms(submasks, edo)[0])
+    return tuple(int(prime_form) for prime_form in prime_forms[np.lexsort((prime_forms, count_bits(prime_forms)))])
+
+
+@functools.lru_cache(maxsize=None)
+def get_table(edo=12, cache_dir=None):
+    """
+    Gets the set-class table for an EDO. The 12-EDO table is small, so it is kept in a single compressed
+    file in the cache directory, and loaded into memory. Other tables are loaded from the cache directory,
+    or built and saved there first, and are memory-mapped read-only.
+    :param edo: The number of divisions of the octave
+    :param cache_dir: The cache directory (if None, CACHE_DIR)
+    :return: The SetClassTable
+    """
+    if edo == 12:
+        path = os.path.join(CACHE_DIR if cache_dir is None else cache_dir, f"set_class_table{edo}.npz")
+        if os.path.exists(path):
+            with np.load(path) as file:
+                arrays = {name: file[name] for name in TABLE_ARRAYS}
+                names = [str(name) for name in file["names"]]
+            return SetClassTable(edo=edo, names=names, **arrays)
+
+        size = 1 << edo
+        arrays = {"prime_form": np.empty(size, dtype=np.int32), "set_class": np.empty(size, dtype=np.int32),
+                  "transformation": np.empty(size, dtype=np.int8),
+                  "ic_vector": np.empty((size, edo // 2), dtype=np.uint8)}
+        prime_forms = build_table(edo, arrays)
+
+        # Put the set classes in Forte order
+        names = get_forte_names(prime_forms)
+        order = sorted(range(len(names)), key=lambda i: [int(n) for n in names[i].replace("Z", "").split("-")])
+        ids = np.empty(len(order), dtype=np.int32)
+        ids[order] = np.arange(len(order), dtype=np.int32)
+        arrays["set_class"] = ids[arrays["set_class"]]
+        arrays["prime_forms"] = prime_forms[order].astype(np.int32)
+        names = [names[i] for i in order]
+
+        # Save the table for next time. If the cache directory can't be written, the table is rebuilt each time.
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.savez_compressed(path[:-4] + ".tmp.npz", names=np.array(names), **arrays)
+            os.replace(path[:-4] + ".tmp.npz", path)
+        except OSError:
+            pass
+        return SetClassTable(edo=edo, names=names, **arrays)
+
+    path = os.path.join(CACHE_DIR if cache_dir is None else cache_dir, f"set_class_table{edo}")
+    if not os.path.exists(path):
+        save_table(edo, path)
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in TABLE_ARRAYS}
+    return SetClassTable(edo=edo, **arrays)
+
+
+def invert_masks(masks, edo=12):
+    """
+    Inverts an array of pcset masks (pitch class n becomes -n)
+    :param masks: An array of masks
+    :param edo: The number of divisions of the octave
+    :return: An array of inverted masks
+    """
+    inverted = masks & 1
+    for pc in range(1, edo):
+        inverted |= ((masks >> pc) & 1) << (edo - pc)
+    return inverted
+
+
+def rotate_masks(masks, n, edo=12):
+    """
+    Transposes an array of pcset masks down by n
+    :param masks: An array of masks
+    :param n: The number of steps to transpose down
+    :param edo: The number of divisions of the octave
+    :return: An array of transposed masks
+    """
+    return ((masks >> n) | (masks << (edo - n))) & ((1 << edo) - 1)
+
+
+def save_table(edo, path):
+    """
+    Builds a set-class table directly into memory-mapped files. The table is built in a temporary
+    directory, which is renamed when it is complete.
+    :param edo: The number of divisions of the octave
+    :param path: The table directory
+    :return:
+    """
+    size = 1 << edo
+    temp_path = path + ".tmp"
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+    shapes = {"prime_form": ((size,), np.int32), "set_class": ((size,), np.int32),
+              "transformation": ((size,), np.int8), "ic_vector": ((size, edo // 2), np.uint8)}
+    arrays = {name: np.lib.format.open_memmap(os.path.join(temp_path, f"{name}.npy"), mode="w+", dtype=dtype,
+                                              shape=shape) for name, (shape, dtype) in shapes.items()}
+    prime_forms = build_table(edo, arrays)
+    np.save(os.path.join(temp_path, "prime_forms.npy"), prime_forms.astype(np.int32))
+    for array in arrays.values():
+        array.flush()
+    del arrays
+    os.replace(temp_path, path)
@@ -22,10 +22,132 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 from fractions import Fraction
+import csv
+import functools
+import math
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import pandas as pd
+import os
+
+# A list of fractional durations (whole note, half note, half triplet, etc.)
+DURATIONS = [Fraction(4, 1), Fraction(2, 1), Fraction(4, 3), Fraction(1, 1), Fraction(4, 5), Fraction(2, 3),
+             Fraction(4, 7), Fraction(1, 2), Fraction(2, 5), Fraction(1, 3), Fraction(2, 7), Fraction(1, 4),
+             Fraction(1, 5), Fraction(1, 6), Fraction(1, 7), Fraction(1, 8)]
+
+
+def find_metric_modulations(initial_tempo, target_tempos, ratios: list, max_length: int, num_results: int=None,
+                            shortest: bool=False, tempo_range: tuple=None):
+    """
+    Finds chains of metric modulations from a tempo to one or more target tempos. The search meets in the middle:
+    it expands tempos forward from the initial tempo and backward from the targets, each for half the chain length,
+    and joins the two wherever they reach the same tempo. Each tempo is expanded once per step, and the expansions
+    are cached between searches.
+    :param initial_tempo: The initial tempo
+    :param target_tempos: A target tempo, or a list or set of target tempos
+    :param ratios: The allowed metric modulation ratios
+    :param max_length: The maximum number of modulations in a chain
+    :param num_results: The maximum number of chains to return (if None, all chains are returned)
+    :param shortest: Whether or not to return only the shortest chains
+    :param tempo_range: An optional (lowest, highest) range. Chains may not pass through tempos outside of it.
+    :return: A list of chains, as lists of ratios. Shorter chains come first, and chains of the same length are
+    ordered by the complexity of their ratios (the sum of log2(numerator * denominator)).
+    """
+    if type(target_tempos) not in (list, set, frozenset, tuple):
+        target_tempos = [target_tempos]
+    initial_tempo = Fraction(initial_tempo)
+    targets = frozenset(Fraction(t) for t in target_tempos)
+    ratios = tuple(sorted(set(Fraction(r) for r in ratios)))
+    if tempo_range is not None:
+        tempo_range = (Fraction(tempo_range[0]), Fraction(tempo_range[1]))
+    forward = get_modulation_layers(frozenset([initial_tempo]), ratios, max_length - max_length // 2, tempo_range, True)
+    backward = get_modulation_layers(targets, ratios, max_length // 2, tempo_range, False)
+
+    # Shorter chains always come first, so we can stop at the first length that provides enough chains
+    chains = []
+    for length in range(max_length + 1):
+        forward_length = length - length // 2
+        length_chains = []
+        for tempo in forward[forward_length].keys() & backward[length // 2].keys():
+            for start in get_modulation_paths(forward, forward_length, tempo, True):
+                for end in get_modulation_paths(backward, length // 2, tempo, False):
+                    length_chains.append(start + end)
+        length_chains.sort(key=lambda chain: sum(math.log2(r.numerator * r.denominator) for r in chain))
+        chains += length_chains
+        if (shortest and len(chains) > 0) or (num_results is not None and len(chains) >= num_results):
+            break
+    return chains if num_results is None else chains[:num_results]
+
+
+def get_duplicate_colors(num_groups):
+    """
+    Gets a color for each group of duplicate tempos
+    :param num_groups: The number of groups
+    :return: A list of colors
+    """
+    import matplotlib.colors as mcolors
+    colors = [color for name, color in mcolors.CSS4_COLORS.items() if not ("white" in name or "grey" in name or
+              "gray" in name or "black" in name or "dark" in name)]
+    colors.reverse()
+    return [colors[i % len(colors)] for i in range(num_groups)]
+
+
+def get_duration_labels(durations):
+    """
+    Gets table column labels for a list of durations
+    :param durations: A list of durations
+    :return: A list of labels
+    """
+    labels = []
+    for f in durations:
+        f = Fraction(f)
+        if f.denominator == 1:
+            labels.append(f"{f.numerator}")
+        else:
+            labels.append(f"{f.numerator}/{f.denominator}")
+    return labels
+
+
+@functools.lru_cache(maxsize=64)
+def get_modulation_layers(tempos, ratios, depth, tempo_range, forward):
+    """
+    Expands a set of tempos by metric modulation, one step at a time
+    :param tempos: A frozenset of tempos
+    :param ratios: A tuple of ratios
+    :param depth: The number of steps
+    :param tempo_range: An optional (lowest, highest) range
+    :param forward: Whether to multiply the tempos by the ratios (forward), or divide them (backward)
+    :return: A list of layers. Layer d maps each tempo reachable in d steps to a list of (tempo, ratio)
+    links to the previous layer.
+    """
+    layers = [{tempo: [] for tempo in tempos}]
+    for d in range(depth):
+        layer = {}
+        for tempo in layers[-1]:
+            for ratio in ratios:
+                new_tempo = tempo * ratio if forward else tempo / ratio
+                if tempo_range is None or tempo_range[0] <= new_tempo <= tempo_range[1]:
+                    if new_tempo not in layer:
+                        layer[new_tempo] = []
+                    layer[new_tempo].append((tempo, ratio))
+        layers.append(layer)
+    return layers
+
+
+def get_modulation_paths(layers, depth, tempo, forward):
+    """
+    Lists the ratio paths through a set of layers that lead to (forward) or away from (backward) a tempo
+    :param layers: The layers from get_modulation_layers
+    :param depth: The layer of the tempo
+    :param tempo: The tempo
+    :param forward: Whether the layers were expanded forward
+    :return: A list of ratio paths, in chain order
+    """
+    if depth == 0:
+        return [[]]
+    paths = []
+    for linked_tempo, ratio in layers[depth][tempo]:
+        for path in get_modulation_paths(layers, depth - 1, linked_tempo, forward):
+            paths.append(path + [ratio] if forward else [ratio] + path)
+    return paths
 
 
 def make_metric_modulation_chain(initial_tempo, ratios: list):
@@ -41,78 +163,112 @@ def make_metric_modulation_chain(initial_tempo, ratios: list):
     return tempos
 
 
-def plot_tempo_table(quarter_note_tempos: list, durations: list=None):
+def make_tempo_figure(quarter_note_tempos: list, durations: list=None, figure=None):
     """
-    Makes a table of tempos based on a list of quarter-note tempos
+    Draws a tempo table on a matplotlib figure. Duplicate tempos are flagged with matching colors.
     :param quarter_note_tempos: A list of quarter-note tempos
     :param durations: An optional list of durations if you want to override the provided one
-    :return: None
+    :param figure: The figure to draw on. If None, a new Figure is made without pyplot, so no display is needed.
+    :return: The figure
+    :raise ValueError: If there are no tempos or no durations
     """
-    # A list of fractional durations (whole note, half note, half triplet, etc.)
-    DURATIONS = [Fraction(4, 1), Fraction(2, 1), Fraction(4, 3), Fraction(1, 1), Fraction(4, 5), Fraction(2, 3),
-                 Fraction(4, 7), Fraction(1, 2), Fraction(2, 5), Fraction(1, 3), Fraction(2, 7), Fraction(1, 4),
-                 Fraction(1, 5), Fraction(1, 6), Fraction(1, 7), Fraction(1, 8)]
+    from matplotlib.figure import Figure
     if durations is None:
         durations = DURATIONS
+    if len(quarter_note_tempos) == 0 or len(durations) == 0:
+        raise ValueError("Can't make a tempo figure without at least one tempo and one duration.")
+    numerators, denominators, groups = tempo_table(quarter_note_tempos, durations)
+    colors = get_duplicate_colors(int(groups.max()) + 1)
 
-    # Set up colors for duplicate color flagging in the table
-    colors = mcolors.CSS4_COLORS
-    colors_del = []
-    for color in colors:
-        if "white" in color or "grey" in color or "gray" in color or "black" in color or "dark" in color:
-            colors_del.append(color)
-    for color in colors_del:
-        del colors[color]
-
-    # Set up table headers
-    columns = []
-    for f in durations:
-        if f.denominator == 1:
-            columns.append(f"{f.numerator}")
-        else:
-            columns.append(f"{f.numerator}/{f.denominator}")
-
-    # Convert the tempo list to Fractions
-    tempos = [Fraction(t) for t in quarter_note_tempos]
-
-    # Build the tempo table
-    duplicate_tempi = {}
-    tempo_table = np.zeros((len(tempos), len(durations)))
-    for i in range(len(tempos)):
-        for j in range(len(durations)):
-            current_tempo = tempos[i] / durations[j]
-            tempo_table[i][j] = current_tempo
-            if current_tempo not in duplicate_tempi:
-                duplicate_tempi[current_tempo] = [1, ""]
-            else:
-                duplicate_tempi[current_tempo][0] += 1
-    for key in duplicate_tempi:
-        if duplicate_tempi[key][0] > 1:
-            color = colors.popitem()
-            duplicate_tempi[key][1] = color[1]
-
-    # Display the table
-    df = pd.DataFrame(tempo_table, columns=columns)
-    colors = mcolors.CSS4_COLORS
-    plt.rcParams["font.family"] = "Segoe UI"
-    fig, ax = plt.subplots()
-    # fig.set_size_inches(10, 5)
-    fig.canvas.setWindowTitle("Tempo Table")
+    if figure is None:
+        fig = Figure(figsize=(0.7 * len(durations) + 1, 0.3 * len(quarter_note_tempos) + 1))
+    else:
+        fig = figure
     fig.patch.set_visible(False)
+    ax = fig.add_subplot()
     ax.axis("off")
-    # ax.axis("tight")
-    t = ax.table(cellText=df.values.round(2), colLabels=columns, colColours=["#DDDDDD" for i in range(len(durations))], loc="center")
+    t = ax.table(cellText=(numerators / denominators).round(2), colLabels=get_duration_labels(durations),
+                 colColours=["#DDDDDD" for i in range(len(durations))], loc="center")
     t.auto_set_font_size(False)
     t.set_fontsize(11)
-    p = t.properties()
-    # print(p)
-    for c in p["celld"]:
-        print(c)
-        if (c[0] < len(tempos)):
-            if tempo_table[c[0], c[1]] in duplicate_tempi:
-                if duplicate_tempi[tempo_table[c[0], c[1]]][0] > 1:
-                    p["celld"][(c[0] + 1, c[1])].set(color=duplicate_tempi[tempo_table[c[0], c[1]]][1])
+    cells = t.get_celld()
+    for i, j in zip(*np.nonzero(groups >= 0)):
+        cells[(i + 1, j)].set(color=colors[groups[i, j]])
     fig.tight_layout()
+    return fig
+
+
+def plot_tempo_table(quarter_note_tempos: list, durations: list=None):
+    """
+    Makes a table of tempos based on a list of quarter-note tempos, and shows it in a window
+    :param quarter_note_tempos: A list of quarter-note tempos
+    :param durations: An optional list of durations if you want to override the provided one
+    :return: None
+    """
+    import matplotlib.pyplot as plt
+    fig = make_tempo_figure(quarter_note_tempos, durations, plt.figure())
+    fig.canvas.manager.set_window_title("Tempo Table")
     plt.show()
 
-    
\ No newline at end of file
+
+def tempo_table(quarter_note_tempos: list, durations: list=None):
+    """
+    Makes a table of tempos based on a list of quarter-note tempos. Entry [i, j] is the tempo of the
+    duration j at the quarter-note tempo i, as an exact fraction.
+    :param quarter_note_tempos: A list of quarter-note tempos
+    :param durations: An optional list of durations if you want to override the provided one
+    :return: A tuple (numerators, denominators, groups) of integer arrays of shape (tempos, durations).
+    Tempos that appear more than once in the table share a group number; all other entries have group -1.
+    """
+    if durations is None:
+        durations = DURATIONS
+    tempos = [Fraction(t) for t in quarter_note_tempos]
+    durations = [Fraction(d) for d in durations]
+    tempo_numerators = np.array([t.numerator for t in tempos], dtype=np.int64).reshape((-1, 1))
+    tempo_denominators = np.array([t.denominator for t in tempos], dtype=np.int64).reshape((-1, 1))
+    duration_numerators = np.array([d.numerator for d in durations], dtype=np.int64).reshape((1, -1))
+    duration_denominators = np.array([d.denominator for d in durations], dtype=np.int64).reshape((1, -1))
+
+    # Divide the tempos by the durations and reduce
+    numerators = tempo_numerators * duration_denominators
+    denominators = tempo_denominators * duration_numerators
+    gcd = np.gcd(numerators, denominators)
+    numerators //= gcd
+    denominators //= gcd
+
+    # Group duplicate tempos, numbering the groups in order of first appearance
+    pairs = np.stack((numerators.ravel(), denominators.ravel()), axis=1)
+    unique, first, inverse, counts = np.unique(pairs, axis=0, return_index=True, return_inverse=True,
+                                               return_counts=True)
+    inverse = inverse.reshape(-1)
+    duplicates = np.nonzero(counts > 1)[0]
+    group_numbers = np.full(len(unique), -1, dtype=np.int64)
+    group_numbers[duplicates[np.argsort(first[duplicates])]] = np.arange(len(duplicates))
+    groups = group_numbers[inverse].reshape(numerators.shape)
+    return numerators, denominators, groups
+
+
+def write_tempo_table(path, quarter_note_tempos: list, durations: list=None):
+    """
+    Writes a tempo table to a file without a display. The format depends on the file extension: .csv files get
+    the exact fractions, the decimal tempos, and the duplicate groups, and any other extension matplotlib can
+    save (such as .png or .svg) gets a rendered table.
+    :param path: The file path
+    :param quarter_note_tempos: A list of quarter-note tempos
+    :param durations: An optional list of durations if you want to override the provided one
+    :return: None
+    """
+    if durations is None:
+        durations = DURATIONS
+    if os.path.splitext(path)[1].lower() == ".csv":
+        numerators, denominators, groups = tempo_table(quarter_note_tempos, durations)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["quarter_tempo", "duration", "tempo", "fraction", "group"])
+            labels = get_duration_labels(durations)
+            for i in range(numerators.shape[0]):
+                for j in range(numerators.shape[1]):
+                    writer.writerow([quarter_note_tempos[i], labels[j], round(numerators[i, j] / denominators[i, j], 4),
+                                     f"{numerators[i, j]}/{denominators[i, j]}", groups[i, j]])
+    else:
+        make_tempo_figure(quarter_note_tempos, durations).savefig(path)
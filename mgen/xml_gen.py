@@ -9,9 +9,175 @@ This file contains functions for creating Music21 scores and exporting them to M
 
 import music21
 import numpy
+import os
 import xml.etree.ElementTree
 
 from pctheory import pitch
+from .xml_writer import get_bar_splits, make_compact_list
+
+
+class ScoreBuilder:
+    """
+    Wraps a score and keeps a measure number -> Measure index for each Part or PartStaff, so items and sequences
+    can be added without scanning the parts. The methods match the module-level functions of the same name.
+    If measures are added to the score some other way, call refresh().
+    """
+    def __init__(self, score):
+        """
+        Creates a ScoreBuilder
+        :param score: The score
+        """
+        self.score = score
+        self.measures = {}           # id(part) -> list of Measures in the part
+        self.measure_positions = {}  # id(part) -> {measure number: list of positions in the measure list}
+        self.refresh()
+
+    def add_item(self, part, item, measure_no, offset=0):
+        """
+        Adds an item such as a Clef, KeySignature, or TimeSignature to a Part or PartStaff
+        :param part: The Part or PartStaff
+        :param item: The item (can be anything, including Clef, KeySignature, TimeSignature, Note, Rest, etc.
+        :param measure_no: The measure number
+        :param offset: The offset position (default to 0)
+        :return:
+        """
+        for position in self.measure_positions[id(part)].get(measure_no, []):
+            measure = self.measures[id(part)][position]
+            # Find the index at which to insert the item.
+            index = len(measure)
+            for i in range(len(measure)):
+                if measure[i].offset >= offset:
+                    index = i
+                    break
+            measure.insert(index, item)
+
+    def add_measures(self, num=10, start_num=1, key=None, meter=None, bar_duration=4.0, initial_offset=0.0,
+                     padding_left=0.0, padding_right=0.0):
+        """
+        Adds measures to the score (see add_measures) and updates the index
+        :return:
+        """
+        add_measures(self.score, num, start_num, key, meter, bar_duration, initial_offset, padding_left, padding_right)
+        self.refresh()
+
+    def add_sequence(self, part, item_sequence, lyric_sequence=None, measure_no=1, bar_duration=4.0):
+        """
+        Adds a sequence of notes or chords to a Part or PartStaff
+        :param part: The Part or PartStaff
+        :param item_sequence: A list of pitches, chords, or rests in order.
+        :param lyric_sequence: A list of lyrics corresponding to the pitch durations. If the current index is a list, we can make multiple verses.
+        :param measure_no: The measure number
+        :param bar_duration: The quarter duration of the first measure
+        :return:
+        """
+        positions = self.measure_positions[id(part)].get(measure_no, [0])
+        add_sequence_at(self.measures[id(part)], positions[-1], item_sequence, lyric_sequence, bar_duration)
+
+    def add_sequence_bulk(self, part, item_sequence, lyric_sequence=None, measure_no=1, bar_duration=4.0):
+        """
+        Adds a sequence of notes or chords to a Part or PartStaff in bulk (see add_sequence_bulk)
+        :param part: The Part or PartStaff
+        :param item_sequence: A list of music21 items or compact tuples in order.
+        :param lyric_sequence: A list of lyrics corresponding to the pitch durations. If the current index is a list, we can make multiple verses.
+        :param measure_no: The measure number
+        :param bar_duration: The quarter duration of the first measure
+        :return:
+        """
+        positions = self.measure_positions[id(part)].get(measure_no, [0])
+        add_sequence_bulk_at(self.measures[id(part)], positions[-1], item_sequence, lyric_sequence, bar_duration)
+
+    def get_measure(self, part, measure_no):
+        """
+        Gets a measure by number
+        :param part: The Part or PartStaff
+        :param measure_no: The measure number
+        :return: The Measure, or None if the part has no measure with that number
+        """
+        positions = self.measure_positions[id(part)].get(measure_no)
+        return self.measures[id(part)][positions[0]] if positions else None
+
+    def refresh(self):
+        """
+        Rebuilds the measure index for every Part or PartStaff in the score
+        :return:
+        """
+        self.measures = {}
+        self.measure_positions = {}
+        for item in self.score:
+            if type(item) == music21.stream.Part or type(item) == music21.stream.PartStaff:
+                measures = [item2 for item2 in item if type(item2) == music21.stream.Measure]
+                positions = {}
+                for i, measure in enumerate(measures):
+                    positions.setdefault(measure.number, []).append(i)
+                self.measures[id(item)] = measures
+                self.measure_positions[id(item)] = positions
+
+
+class SpellingCache:
+    """
+    Caches semi-closed chord spellings, so a pcset that appears many times is only built and spaced by music21
+    once. Spellings are keyed by the sorted MIDI numbers of the chord, and can be saved to a TSV file and loaded
+    again in a later run.
+    """
+    def __init__(self, path=None, cleanup=False):
+        """
+        Creates a SpellingCache
+        :param path: A TSV file of saved spellings. It is loaded if it exists, and is the default file for save().
+        :param cleanup: Whether or not to run cleanup_semi_closed after make_semi_closed
+        """
+        self.path = path
+        self.cleanup = cleanup
+        self.spellings = {}  # (all integers, sorted MIDI numbers) -> voiced pitch names
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def get_chord(self, pitches, quarter_length=1.0):
+        """
+        Makes a semi-closed chord (see make_semi_closed), using a cached spelling if there is one
+        :param pitches: A list of MIDI numbers
+        :param quarter_length: The quarter duration of the chord
+        :return: The chord
+        """
+        # music21 simplifies the enharmonics of chords made from integers, so they are spelled separately
+        key = (all(type(p) == int for p in pitches), tuple(sorted(float(p) for p in pitches)))
+        if key not in self.spellings:
+            chord = music21.chord.Chord(list(pitches))
+            make_semi_closed(chord)
+            if self.cleanup:
+                cleanup_semi_closed(chord)
+            self.spellings[key] = tuple(p.nameWithOctave for p in chord.pitches)
+        return music21.chord.Chord([music21.pitch.Pitch(name) for name in self.spellings[key]],
+                                   quarterLength=quarter_length)
+
+    def load(self, path):
+        """
+        Loads saved spellings
+        :param path: The TSV file
+        :return:
+        """
+        with open(path, "r") as file:
+            for line in file:
+                cells = line.rstrip("\n").split("\t")
+                if len(cells) == 4 and cells[0] == str(int(self.cleanup)):
+                    key = (cells[1] == "1", tuple(float(p) for p in cells[2].split(" ")))
+                    self.spellings[key] = tuple(cells[3].split(" "))
+
+    def save(self, path=None):
+        """
+        Saves the spellings. Spellings for the other cleanup setting that are already in the file are kept.
+        :param path: The TSV file (if None, the path the cache was created with)
+        :return:
+        """
+        path = self.path if path is None else path
+        lines = []
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                lines = [line for line in file if not line.startswith(str(int(self.cleanup)) + "\t")]
+        with open(path, "w") as file:
+            file.writelines(lines)
+            for (integers, numbers), spelling in self.spellings.items():
+                file.write(f"{int(self.cleanup)}\t{int(integers)}\t{' '.join(str(p) for p in numbers)}\t"
+                           f"{' '.join(spelling)}\n")
 
 
 def add_item(part, item, measure_no, offset=0):
@@ -45,16 +211,30 @@ def add_sequence(part, item_sequence, lyric_sequence=None, measure_no=1, bar_dur
     :param bar_duration: The quarter duration of the first measure
     :return:
     """
-    m = 0                                # The current measure index
-    current_bar_duration = bar_duration  # The current measure duration in quarter notes
-    current_offset = 0                   # The offset for the next chord to insert
+    m = 0  # The current measure index
 
     # Find the starting measure index
     for i in range(len(part)):
         if type(part[i]) == music21.stream.Measure:
             if part[i].number == measure_no:
                 m = i
-    
+
+    add_sequence_at(part, m, item_sequence, lyric_sequence, bar_duration)
+
+
+def add_sequence_at(measures, m, item_sequence, lyric_sequence=None, bar_duration=4.0):
+    """
+    Adds a sequence of notes or chords to a list of measures, starting at a measure index
+    :param measures: A Part or PartStaff, or a list of its measures
+    :param m: The index of the starting measure in measures
+    :param item_sequence: A list of pitches, chords, or rests in order.
+    :param lyric_sequence: A list of lyrics corresponding to the pitch durations. If the current index is a list, we can make multiple verses.
+    :param bar_duration: The quarter duration of the first measure
+    :return:
+    """
+    current_bar_duration = bar_duration  # The current measure duration in quarter notes
+    current_offset = 0                   # The offset for the next chord to insert
+
     # Insert each item
     for i, current_item in enumerate(item_sequence):
         total_duration = item_sequence[i].duration.quarterLength      # The total duration of the chord
@@ -67,10 +247,10 @@ def add_sequence(part, item_sequence, lyric_sequence=None, measure_no=1, bar_dur
             
             # Get the duration of this fragment of the chord
             new_item_duration = 0
-            if current_bar_duration - part[m].paddingLeft - current_offset >= remaining_duration:
+            if current_bar_duration - measures[m].paddingLeft - current_offset >= remaining_duration:
                 new_item_duration = remaining_duration
             else:
-                new_item_duration = current_bar_duration - part[m].paddingLeft - current_offset
+                new_item_duration = current_bar_duration - measures[m].paddingLeft - current_offset
 
             # CREATE NOTE, CHORD, OR REST
             if type(current_item) == music21.chord.Chord:
@@ -101,16 +281,82 @@ def add_sequence(part, item_sequence, lyric_sequence=None, measure_no=1, bar_dur
                         new_item_to_insert.lyrics = [music21.note.Lyric(number=1, text=lyric_sequence[i])]
 
             # Insert the chord into the current measure
-            part[m].insert(current_offset, new_item_to_insert)
+            measures[m].insert(current_offset, new_item_to_insert)
 
             # Update the offset and remaining duration
             current_offset += new_item_duration
             remaining_duration -= new_item_duration
-            if current_offset >= current_bar_duration - part[m].paddingLeft:
+            if current_offset >= current_bar_duration - measures[m].paddingLeft:
                 m += 1
                 current_offset = 0
-                if m < len(part) and part[m].timeSignature is not None:
-                    current_bar_duration = part[m].barDuration.quarterLength
+                if m < len(measures) and measures[m].timeSignature is not None:
+                    current_bar_duration = measures[m].barDuration.quarterLength
+
+
+def add_sequence_bulk(part, item_sequence, lyric_sequence=None, measure_no=1, bar_duration=4.0):
+    """
+    Adds a sequence of notes or chords to a Part or PartStaff. This produces the same result as add_sequence,
+    but all bar splits and ties are computed first, and then each measure is filled in a single pass, so
+    music21 only updates each measure once. Items can be music21 Notes, Chords, and Rests, or compact
+    (pitches, quarter duration) tuples (see make_compact_list). Compact items are only turned into music21
+    objects as each fragment is inserted.
+    :param part: The Part or PartStaff
+    :param item_sequence: A list of music21 items or compact tuples in order.
+    :param lyric_sequence: A list of lyrics corresponding to the pitch durations. If the current index is a list, we can make multiple verses.
+    :param measure_no: The measure number
+    :param bar_duration: The quarter duration of the first measure
+    :return:
+    """
+    measures = [item for item in part if type(item) == music21.stream.Measure]
+    m = 0
+    for i in range(len(measures)):
+        if measures[i].number == measure_no:
+            m = i
+    add_sequence_bulk_at(measures, m, item_sequence, lyric_sequence, bar_duration)
+
+
+def add_sequence_bulk_at(measures, m, item_sequence, lyric_sequence=None, bar_duration=4.0):
+    """
+    Adds a sequence of notes or chords to a list of measures in bulk (see add_sequence_bulk)
+    :param measures: A list of Measures
+    :param m: The index of the starting measure in measures
+    :param item_sequence: A list of music21 items or compact tuples in order.
+    :param lyric_sequence: A list of lyrics corresponding to the pitch durations. If the current index is a list, we can make multiple verses.
+    :param bar_duration: The quarter duration of the first measure
+    :return:
+    """
+    # Find the available duration of each measure
+    bar_lengths = []
+    current_bar_duration = bar_duration
+    for i in range(m, len(measures)):
+        if i > m and measures[i].timeSignature is not None:
+            current_bar_duration = measures[i].barDuration.quarterLength
+        bar_lengths.append(current_bar_duration - measures[i].paddingLeft)
+
+    durations = [item[1] if type(item) == tuple else item.duration.quarterLength for item in item_sequence]
+    current_measure = None
+    for i, measure_index, offset, duration, tie in get_bar_splits(durations, bar_lengths):
+        new_item_to_insert = make_fragment(item_sequence[i], duration)
+
+        # TIES AND LYRICS: Create ties and attach lyrics as appropriate
+        if tie is not None:
+            new_item_to_insert.tie = music21.tie.Tie(tie)
+        if lyric_sequence is not None and (tie is None or tie == "start"):
+            if type(lyric_sequence[i]) == list:
+                first_number = 0 if tie == "start" else 1
+                new_item_to_insert.lyrics = [music21.note.Lyric(number=j + first_number, text=lyric_sequence[i][j])
+                                             for j in range(len(lyric_sequence[i]))]
+            else:
+                new_item_to_insert.lyrics = [music21.note.Lyric(number=1, text=lyric_sequence[i])]
+
+        # Insert without updating the measure, and update it once all of its fragments are in place
+        if measures[m + measure_index] is not current_measure:
+            if current_measure is not None:
+                current_measure.coreElementsChanged()
+            current_measure = measures[m + measure_index]
+        current_measure.coreInsert(offset, new_item_to_insert)
+    if current_measure is not None:
+        current_measure.coreElementsChanged()
 
 
 def add_instrument(score, name, abbreviation):
@@ -251,11 +497,32 @@ def export_to_xml(score, path):
         file.write(output)
 
 
-def make_music21_list(items, durations):
+def make_fragment(item, duration):
+    """
+    Makes a new music21 Note, Chord, or Rest for a fragment of an item
+    :param item: A music21 Note, Chord, or Rest, or a compact (pitches, quarter duration) tuple
+    :param duration: The quarter duration of the fragment
+    :return: The new music21 item
+    """
+    if type(item) == tuple:
+        if len(item[0]) == 0:
+            return music21.note.Rest(quarterLength=duration)
+        elif len(item[0]) == 1:
+            return music21.note.Note(item[0][0], quarterLength=duration)
+        return music21.chord.Chord(list(item[0]), quarterLength=duration)
+    elif type(item) == music21.chord.Chord:
+        return music21.chord.Chord(item.notes, quarterLength=duration)
+    elif type(item) == music21.note.Note:
+        return music21.note.Note(nameWithOctave=item.nameWithOctave, quarterLength=duration)
+    return music21.note.Rest(quarterLength=duration)
+
+
+def make_music21_list(items, durations, spelling=None):
     """
     Makes a music21 list
     :param items: A list of items
     :param durations: A list of quarter durations
+    :param spelling: A SpellingCache. If provided, chords are made semi-closed with it.
     :return: A list of music21 items
     """
     m_list = []
@@ -271,9 +538,15 @@ def make_music21_list(items, durations):
                 if len(current_item) == 0:
                     m_list.append(music21.note.Rest(current_duration))
                 elif type(current_item[0]) == int or type(current_item[0]) == float:
-                    m_list.append(music21.chord.Chord([j + 60 for j in current_item], quarterLength=current_duration))
+                    if spelling is not None:
+                        m_list.append(spelling.get_chord([j + 60 for j in current_item], current_duration))
+                    else:
+                        m_list.append(music21.chord.Chord([j + 60 for j in current_item], quarterLength=current_duration))
                 elif type(current_item[0]) == pitch.Pitch:
-                    m_list.append(music21.chord.Chord([music21.pitch.Pitch(p.p / (p.mod / 12) + 60) for p in current_item], quarterLength=current_duration))
+                    if spelling is not None:
+                        m_list.append(spelling.get_chord([p.p / (p.mod / 12) + 60 for p in current_item], current_duration))
+                    else:
+                        m_list.append(music21.chord.Chord([music21.pitch.Pitch(p.p / (p.mod / 12) + 60) for p in current_item], quarterLength=current_duration))
             
             elif type(current_item) == float or type(current_item) == int:
                 if current_item == -numpy.inf:
@@ -305,33 +578,58 @@ def make_semi_closed(chord):
             item.midi -= 12
 
 
-def remove_empty_measures(score):
+def remove_empty_measures(score, renumber=False, reoffset=False):
     """
     Removes empty measures from a score. For a measure to be empty, 
     it must have no entries (notes, chords, or rests) in any voice or part.
+    Each part's element list is rebuilt once, rather than deleting measures one at a time.
     :param score: A score to remove empty measures from
+    :param renumber: Whether or not to renumber the remaining measures consecutively, starting with the first
+    measure number
+    :param reoffset: Whether or not to move the remaining measures so that they follow each other without gaps
     """
     non_empty_measures = set()
+    parts = [item for item in score if type(item) == music21.stream.Part or type(item) == music21.stream.PartStaff]
 
     # Find all measures that are definitely not empty
-    for item in score:
-        if type(item) == music21.stream.Part or type(item) == music21.stream.PartStaff:
-            for item2 in item:
-                if type(item2) == music21.stream.Measure:
-                    if len(item2) > 0:
-                        non_empty_measures.add(item2.number)
+    for item in parts:
+        for item2 in item:
+            if type(item2) == music21.stream.Measure:
+                if len(item2) > 0:
+                    non_empty_measures.add(item2.number)
+
+    # Rebuild each part with the remaining measures
+    for item in parts:
+        kept = []
+        first_number = None
+        first_offset = None
+        for item2 in item.elements:
+            if type(item2) == music21.stream.Measure:
+                if first_number is None:
+                    first_number = item2.number
+                    first_offset = item.elementOffset(item2)
+                if item2.number not in non_empty_measures:
+                    item2.sites.remove(item)
+                    item2.activeSite = None
+                    continue
+            kept.append((item.elementOffset(item2), item2))
+        if len(kept) == len(item.elements) and not renumber and not reoffset:
+            continue
+
+        item.elements = [item2 for offset, item2 in kept]
+        current_number = first_number
+        current_offset = first_offset
+        for offset, item2 in kept:
+            if type(item2) == music21.stream.Measure:
+                if renumber:
+                    item2.number = current_number
+                    current_number += 1
+                if reoffset:
+                    offset = current_offset
+                    current_offset += item2.duration.quarterLength - item2.paddingLeft
+            item.coreSetElementOffset(item2, offset)
+        item.coreElementsChanged()
 
-    # Remove all other measures
-    for item in score:
-        if type(item) == music21.stream.Part or type(item) == music21.stream.PartStaff:
-            i = 0
-            while i < len(item):
-                if type(item[i]) == music21.stream.Measure:
-                    if item[i].number not in non_empty_measures:
-                        del item[i]
-                        i -= 1
-                i += 1
-    
 
 def split_pset_for_grand_staff(chord):
     """
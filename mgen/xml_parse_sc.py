@@ -6,8 +6,16 @@ This file contains functionality for parsing MusicXML data into lists of Notes f
 Copyright © 2022 by Jeff Martin. All rights reserved.
 """
 
+import bisect
+import contextlib
 from fractions import Fraction
+import functools
+import hashlib
+import io
 import music21
+import numpy as np
+import os
+import re
 from pctheory import pitch
 
 MAP12 = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
@@ -15,6 +23,155 @@ MAP24 = {"C": 0, "D": 4, "E": 8, "F": 10, "G": 14, "A": 18, "B": 22}
 PC12 = 12
 PC24 = 24
 
+# The range of 24-EDO pitches covered by the equal loudness lookup table (MIDI notes 0 through 127.5)
+EQUAL_LOUDNESS_LOW = -120
+EQUAL_LOUDNESS_HIGH = 135
+
+# A new SuperCollider score file is started once more than this many measures have been written to the current one
+SC_CHUNK_MEASURES = 50
+
+# Templates for each kind of event written to a SuperCollider score. The event is passed as e, its index in the
+# voice as i, the voice index as v, and the score name as name.
+SC_GRANULAR_TEMPLATE = "~dict = Dictionary.new;\n" \
+                       "~dict.put(\\i0, {v});\n" \
+                       "~dict.put(\\i1, {i});\n" \
+                       "~dict.put(\\buf0, {e.buffer});\n" \
+                       "~dict.put(\\buf1, 1);\n" \
+                       "~dict.put(\\duration, {e.duration});\n" \
+                       "~dict.put(\\env, {e.env});\n" \
+                       "~dict.put(\\envlen, {e.envlen});\n" \
+                       "~dict.put(\\measure, {e.measure});\n" \
+                       "~dict.put(\\mul, {e.mul});\n" \
+                       "~dict.put(\\out, {e.bus_out});\n" \
+                       "~dict.put(\\pitch, {e.pitch.p});\n" \
+                       "~dict.put(\\start, {e.start_time});\n" \
+                       "~dict.put(\\synth, \\synth{e.synth}_{e.envlen});\n" \
+                       "~dict.put(\\type, \\Granular);\n" \
+                       "~dict.put(\\wait, {e.wait});\n" \
+                       "~{name}[{v}].add(~dict);\n"
+SC_FM_TEMPLATE = "~dict = Dictionary.new;\n" \
+                 "~dict.put(\\i0, {v});\n" \
+                 "~dict.put(\\i1, {i});\n" \
+                 "~dict.put(\\buf, {e.buffer});\n" \
+                 "~dict.put(\\mod_curves, {e.mod_curves});\n" \
+                 "~dict.put(\\duration, {e.duration});\n" \
+                 "~dict.put(\\env, {e.env});\n" \
+                 "~dict.put(\\envlen, {e.envlen});\n" \
+                 "~dict.put(\\mod_levels, {e.mod_levels});\n" \
+                 "~dict.put(\\measure, {e.measure});\n" \
+                 "~dict.put(\\mul, {e.mul});\n" \
+                 "~dict.put(\\out, {e.bus_out});\n" \
+                 "~dict.put(\\pitch, {e.pitch.p});\n" \
+                 "~dict.put(\\start, {e.start_time});\n" \
+                 "~dict.put(\\synth, \\synth{e.synth}_{e.envlen});\n" \
+                 "~dict.put(\\mod_times, {e.mod_times});\n" \
+                 "~dict.put(\\type, \\FM);\n" \
+                 "~dict.put(\\wait, {e.wait});\n" \
+                 "~{name}[{v}].add(~dict);\n"
+SC_SOUND_TEMPLATE = "~dict = Dictionary.new;\n" \
+                    "~dict.put(\\i0, {v});\n" \
+                    "~dict.put(\\i1, {i});\n" \
+                    "~dict.put(\\buf, {e.buffer});\n" \
+                    "~dict.put(\\duration, {e.duration});\n" \
+                    "~dict.put(\\env, {e.env});\n" \
+                    "~dict.put(\\envlen, {e.envlen});\n" \
+                    "~dict.put(\\measure, {e.measure});\n" \
+                    "~dict.put(\\mul, {e.mul});\n" \
+                    "~dict.put(\\out, {e.bus_out});\n" \
+                    "~dict.put(\\pitch, {e.pitch.p});\n" \
+                    "~dict.put(\\rate, 1);\n" \
+                    "~dict.put(\\start, {e.start_time});\n" \
+                    "~dict.put(\\synth, {e.synth});\n" \
+                    "~dict.put(\\type, \\Sound);\n" \
+                    "~dict.put(\\wait, {e.wait});\n" \
+                    "~{name}[{v}].add(~dict);\n"
+SC_DYNAMIC_TEMPLATE = "~dict = Dictionary.new;\n" \
+                      "~dict.put(\\curves, {e.curves});\n" \
+                      "~dict.put(\\duration, {e.duration});\n" \
+                      "~dict.put(\\in, {e.bus_in});\n" \
+                      "~dict.put(\\levels, {e.levels});\n" \
+                      "~dict.put(\\out, {e.bus_out});\n" \
+                      "~dict.put(\\start, {e.start_time});\n" \
+                      "~dict.put(\\synth, \\dynamic{e.synth});\n" \
+                      "~dict.put(\\times, {e.times});\n" \
+                      "~dict.put(\\type, \\Dynamic);\n" \
+                      "~{name}[{v}].add(~dict);\n"
+SC_EFFECT_TEMPLATE = "~dict = Dictionary.new;\n" \
+                     "~dict.put(\\duration, {e.duration});\n" \
+                     "~dict.put(\\in, {e.bus_in});\n" \
+                     "~dict.put(\\out, {e.bus_out});\n" \
+                     "~dict.put(\\start, {e.start_time});\n" \
+                     "~dict.put(\\synth, \\effect{e.synth});\n" \
+                     "~dict.put(\\type, \\Effect);\n" \
+                     "~{name}[{v}].add(~dict);\n"
+SC_PAN_TEMPLATE = "~dict = Dictionary.new;\n" \
+                  "~dict.put(\\duration, {e.duration});\n" \
+                  "~dict.put(\\in, {e.bus_in});\n" \
+                  "~dict.put(\\pan2, {e.pan2});\n" \
+                  "~dict.put(\\panx, {e.panx});\n" \
+                  "~dict.put(\\panw, {e.panw});\n" \
+                  "~dict.put(\\start, {e.start_time});\n" \
+                  "~dict.put(\\type, \\Pan);\n" \
+                  "~{name}[{v}].add(~dict);\n"
+
+# Columns of the compact SuperCollider data format (see write_sc_data). Each column has a key and a kind that tells
+# the loader how to decode it: i = integer, f = float, s = symbol, b = buffer (integer or string), a = array,
+# n = nested array.
+SC_DATA_COLUMNS = [("i0", "i"), ("i1", "i"), ("type", "s"), ("synth", "s"), ("buf0", "b"), ("buf1", "i"),
+                   ("buf", "b"), ("rate", "f"), ("duration", "f"), ("env", "n"), ("envlen", "i"), ("measure", "i"),
+                   ("mul", "f"), ("out", "i"), ("in", "i"), ("pitch", "f"), ("start", "f"), ("wait", "f"),
+                   ("mod_levels", "a"), ("mod_times", "a"), ("mod_curves", "a"), ("levels", "a"), ("times", "a"),
+                   ("curves", "a"), ("pan2", "f"), ("panx", "f"), ("panw", "f")]
+
+# The sclang stub that loads a compact data file into the same structure that the generated score code builds
+SC_DATA_LOADER_TEMPLATE = """(
+var data = TabFileReader.read(thisProcess.nowExecutingPath.dirname +/+ "{data_file}", true);
+var header = data[0][1..].collect({{|column| column.split($:)}});
+~{name} = Array.fill({num_voices}, {{List.new}});
+data[1..].do({{|row|
+    var dict = Dictionary.new;
+    row[1..].do({{|cell, j|
+        if(cell.size > 0, {{
+            dict.put(header[j][0].asSymbol, switch(header[j][1],
+                "i", {{cell.asInteger}},
+                "f", {{cell.asFloat}},
+                "s", {{cell.asSymbol}},
+                "b", {{if(cell[0] == $", {{cell[1..(cell.size - 2)]}}, {{cell.asInteger}})}},
+                "a", {{cell.split($ ).reject(_.isEmpty).collect(_.asFloat)}},
+                "n", {{cell.split($|).collect({{|group| group.split($ ).reject(_.isEmpty).collect(_.asFloat)}})}}
+            ));
+        }});
+    }});
+    ~{name}[row[0].asInteger].add(dict);
+}});
+)
+"""
+
+# The sclang stub that reloads the chunks of an exported score whose hashes differ from the ones loaded before
+# (see dump_sc_to_file). The hashes of the loaded chunks are kept in ~name_hashes. The manifest is the only
+# place the number of chunks is recorded, so the stub drops the chunks (and hashes) that are no longer listed,
+# and then rebuilds the score from the chunks that remain.
+SC_MANIFEST_LOADER_TEMPLATE = """(
+var dir = thisProcess.nowExecutingPath.dirname;
+var rows = TabFileReader.read(dir +/+ "{manifest_file}", true)[1..];
+var files = rows.collect({{|row| row[0]}});
+~{name}_hashes = ~{name}_hashes ?? {{Dictionary.new}};
+~{name}_hashes.keys.do({{|key| if(files.includesEqual(key).not, {{~{name}_hashes.removeAt(key)}})}});
+~{name}_chunks = (~{name}_chunks ?? {{[]}}).extend(rows.size, nil);
+rows.do({{|row|
+    if(~{name}_hashes[row[0]] != row[1], {{
+        (dir +/+ row[0]).load;
+        ~{name}_hashes[row[0]] = row[1];
+    }});
+}});
+~{name} = Array.fill({num_voices}, {{|v|
+    var events = List.new;
+    ~{name}_chunks.do({{|chunk| if(chunk.notNil, {{events.addAll(chunk[v])}})}});
+    events;
+}});
+)
+"""
+
 
 class Dynamic:
     """
@@ -53,6 +210,24 @@ class Effect:
         self.start_time = kwargs["start_time"] if "start_time" in kwargs else -1    # start time
 
 
+class HashingWriter:
+    """
+    Wraps a writable text file, keeping a SHA-1 hash of everything written to it
+    """
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha1()
+
+    def write(self, text):
+        """
+        Writes text to the file
+        :param text: The text
+        :return: The number of characters written
+        """
+        self.hash.update(text.encode())
+        return self.file.write(text)
+
+
 class Note:
     """
     Represents a note with pitch, duration, and start time
@@ -105,15 +280,107 @@ class Sound:
         self.wait = kwargs["wait"] if "wait" in kwargs else 0                       # the time to wait until next note
 
 
-def analyze_xml(xml_name, part_indices=None):
+class VoiceIndex:
+    """
+    Indexes a parsed voice by measure number and by start/end time. Separately chained entries (lists) are
+    indexed by the first Note or Sound they contain. The voice is expected to be in measure order.
+    """
+    def __init__(self, voice):
+        """
+        Creates a VoiceIndex
+        :param voice: A parsed voice
+        """
+        self.highest_measure = 0   # the highest measure number of a Note in the voice
+        self.measures = {}         # measure number -> [start, end) offsets in the voice
+        self.start_times = []      # sorted start times
+        self.start_order = []      # voice offsets corresponding to start_times
+        self.end_times = []        # sorted end times
+        self.end_order = []        # voice offsets corresponding to end_times
+
+        starts = []
+        ends = []
+        for i, item in enumerate(voice):
+            if type(item) == list:
+                item = next((item2 for item2 in item if type(item2) == Note or type(item2) == Sound), None)
+                if item is None:
+                    continue
+            if type(item) == Note and item.measure > self.highest_measure:
+                self.highest_measure = item.measure
+            if item.measure in self.measures:
+                self.measures[item.measure][1] = i + 1
+            else:
+                self.measures[item.measure] = [i, i + 1]
+            if hasattr(item, "start_time"):
+                starts.append((item.start_time, i))
+            if hasattr(item, "end_time"):
+                ends.append((item.end_time, i))
+        starts.sort()
+        ends.sort()
+        self.start_times = [t for t, i in starts]
+        self.start_order = [i for t, i in starts]
+        self.end_times = [t for t, i in ends]
+        self.end_order = [i for t, i in ends]
+
+    def ending_between(self, start_time, end_time):
+        """
+        Gets the voice offsets of all items ending in a time range
+        :param start_time: The start of the range (inclusive)
+        :param end_time: The end of the range (inclusive)
+        :return: A list of offsets, ordered by end time
+        """
+        lower = bisect.bisect_left(self.end_times, start_time)
+        upper = bisect.bisect_right(self.end_times, end_time)
+        return self.end_order[lower:upper]
+
+    def first_within(self, voice, start_time, end_time):
+        """
+        Gets the voice offset of the first item that lies entirely within a time range
+        :param voice: The indexed voice
+        :param start_time: The start of the range (inclusive)
+        :param end_time: The end of the range (inclusive)
+        :return: The offset, or None if no item lies within the range
+        """
+        first = None
+        for i in self.starting_between(start_time, end_time):
+            item = voice[i]
+            if type(item) == list:
+                item = next(item2 for item2 in item if type(item2) == Note or type(item2) == Sound)
+            if item.end_time <= end_time and (first is None or i < first):
+                first = i
+        return first
+
+    def get_measure(self, measure_no):
+        """
+        Gets the voice offsets of all items in a measure
+        :param measure_no: The measure number
+        :return: A range of offsets
+        """
+        if measure_no in self.measures:
+            return range(self.measures[measure_no][0], self.measures[measure_no][1])
+        return range(0)
+
+    def starting_between(self, start_time, end_time):
+        """
+        Gets the voice offsets of all items starting in a time range
+        :param start_time: The start of the range (inclusive)
+        :param end_time: The end of the range (inclusive)
+        :return: A list of offsets, ordered by start time
+        """
+        lower = bisect.bisect_left(self.start_times, start_time)
+        upper = bisect.bisect_right(self.start_times, end_time)
+        return self.start_order[lower:upper]
+
+
+def analyze_xml(xml_name, part_indices=None, index=False):
     """
     Analyzes a MusicXML file and converts it into data useful for SuperCollider
     :param xml_name: The file name
     :param part_indices: The indices of parts to use. If None, extracts all parts.
+    :param index: Whether or not to also return a VoiceIndex for each voice (see index_parts)
     :return: An n-dimensional list of Notes
     """
     file_parts = read_file(xml_name)
-    return parse_parts(file_parts, part_indices)
+    return parse_parts(file_parts, part_indices, index)
 
 
 def convert_pitch24(pitch21):
@@ -122,12 +389,8 @@ def convert_pitch24(pitch21):
     :param pitch21: A music21 pitch
     :return: A Pitch24 object
     """
-    note = MAP24[pitch21.step]
-    octave = pitch21.octave - 4
-    if pitch21.accidental is not None:
-        note += int(2 * pitch21.accidental.alter)
-    note += PC24 * octave
-    return pitch.Pitch24(note)
+    alter = pitch21.accidental.alter if pitch21.accidental is not None else 0
+    return pitch.Pitch24(get_pitch24_number(pitch21.step, alter, pitch21.octave))
 
 
 def dump_parts(new_parts):
@@ -157,166 +420,134 @@ def dump_parts(new_parts):
             current_voice_index += 1
 
 
-def dump_sc(new_parts, score_name):
+def dump_sc(new_parts, score_name, index=None):
     """
     Dumps the new part data in SuperCollider format
     :param new_parts: New (parsed) parts
     :param score_name: The name of the score loading function in the SC file
+    :param index: An up-to-date index of the parts (see index_parts). If None, it will be built.
     :return: A list of SuperCollider score files
     """
     score_list = []
-    data = f"(\n"
-    num_measures_read = 0
-    num_measures = get_highest_measure_no(new_parts)
 
-    # Get the number of voices
-    num_voices = 0
-    for part in new_parts:
-        num_voices += len(part)
-
-    data += "~{0} = Array.fill({1}, {2});\n".format(score_name, num_voices, "{List.new}")
-
-    # A list of current starting indices. We add each measure of each voice, then move on to the
-    # next measure and add the contents of each voice in that measure
-    idx = [0 for i in range(num_voices)]
-
-    # Iterate through all of the measures in the piece
-    for measure_no in range(num_measures + 1):
-        if num_measures_read > 50:
-            data += ")\n"
-            score_list.append(data)
-            data = f"(\n"
-            num_measures_read = 0
-
-        current_voice_index = 0  # The current voice index
-        for part in new_parts:
-            for voice in part:
-                data += f"// Measure {measure_no}, Voice {current_voice_index}\n"
-                # For each item in the current measure for the current voice
-                for i in range(idx[current_voice_index], len(voice)):
-                    # If the flag is false, we have to stop adding things and record the current index
-                    # as the starting point for the next measure's iteration
-                    flag = False
-                    if voice[i].measure == measure_no:
-                        flag = True
-                    # Provided that we can still add the current item, we continue and add it.
-                    if flag:
-                        if type(voice[i]) == Note and voice[i].synth == 0:
-                            data += f"~dict = Dictionary.new;\n" + \
-                                    f"~dict.put(\\i0, {current_voice_index});\n" + \
-                                    f"~dict.put(\\i1, {i});\n" + \
-                                    f"~dict.put(\\buf0, {voice[i].buffer});\n" + \
-                                    f"~dict.put(\\buf1, 1);\n" + \
-                                    f"~dict.put(\\duration, {voice[i].duration});\n" + \
-                                    f"~dict.put(\\env, {voice[i].env});\n" + \
-                                    f"~dict.put(\\envlen, {voice[i].envlen});\n" + \
-                                    f"~dict.put(\\measure, {voice[i].measure});\n" + \
-                                    f"~dict.put(\\mul, {voice[i].mul});\n" + \
-                                    f"~dict.put(\\out, {voice[i].bus_out});\n" + \
-                                    f"~dict.put(\\pitch, {voice[i].pitch.p});\n" + \
-                                    f"~dict.put(\\start, {voice[i].start_time});\n" + \
-                                    f"~dict.put(\\synth, \\synth{voice[i].synth}_{voice[i].envlen});\n" + \
-                                    f"~dict.put(\\type, \\Granular);\n" + \
-                                    f"~dict.put(\\wait, {voice[i].wait});\n" + \
-                                    f"~{score_name}[{current_voice_index}].add(~dict);\n"
-                        elif type(voice[i]) == Note and voice[i].synth >= 10:
-                            data += f"~dict = Dictionary.new;\n" + \
-                                    f"~dict.put(\\i0, {current_voice_index});\n" + \
-                                    f"~dict.put(\\i1, {i});\n" + \
-                                    f"~dict.put(\\buf, {voice[i].buffer});\n" + \
-                                    f"~dict.put(\\mod_curves, {voice[i].mod_curves});\n" + \
-                                    f"~dict.put(\\duration, {voice[i].duration});\n" + \
-                                    f"~dict.put(\\env, {voice[i].env});\n" + \
-                                    f"~dict.put(\\envlen, {voice[i].envlen});\n" + \
-                                    f"~dict.put(\\mod_levels, {voice[i].mod_levels});\n" + \
-                                    f"~dict.put(\\measure, {voice[i].measure});\n" + \
-                                    f"~dict.put(\\mul, {voice[i].mul});\n" + \
-                                    f"~dict.put(\\out, {voice[i].bus_out});\n" + \
-                                    f"~dict.put(\\pitch, {voice[i].pitch.p});\n" + \
-                                    f"~dict.put(\\start, {voice[i].start_time});\n" + \
-                                    f"~dict.put(\\synth, \\synth{voice[i].synth}_{voice[i].envlen});\n" + \
-                                    f"~dict.put(\\mod_times, {voice[i].mod_times});\n" + \
-                                    f"~dict.put(\\type, \\FM);\n" + \
-                                    f"~dict.put(\\wait, {voice[i].wait});\n" + \
-                                    f"~{score_name}[{current_voice_index}].add(~dict);\n"
-                        elif type(voice[i]) == Sound:
-                            data += f"~dict = Dictionary.new;\n" + \
-                                    f"~dict.put(\\i0, {current_voice_index});\n" + \
-                                    f"~dict.put(\\i1, {i});\n" + \
-                                    f"~dict.put(\\buf, {voice[i].buffer});\n" + \
-                                    f"~dict.put(\\duration, {voice[i].duration});\n" + \
-                                    f"~dict.put(\\env, {voice[i].env});\n" + \
-                                    f"~dict.put(\\envlen, {voice[i].envlen});\n" + \
-                                    f"~dict.put(\\measure, {voice[i].measure});\n" + \
-                                    f"~dict.put(\\mul, {voice[i].mul});\n" + \
-                                    f"~dict.put(\\out, {voice[i].bus_out});\n" + \
-                                    f"~dict.put(\\pitch, {voice[i].pitch.p});\n" + \
-                                    f"~dict.put(\\rate, 1);\n" + \
-                                    f"~dict.put(\\start, {voice[i].start_time});\n" + \
-                                    f"~dict.put(\\synth, {voice[i].synth});\n" + \
-                                    f"~dict.put(\\type, \\Sound);\n" + \
-                                    f"~dict.put(\\wait, {voice[i].wait});\n" + \
-                                    f"~{score_name}[{current_voice_index}].add(~dict);\n"
-                        elif type(voice[i]) == Dynamic:
-                            data += f"~dict = Dictionary.new;\n" + \
-                                    f"~dict.put(\\curves, {voice[i].curves});\n" + \
-                                    f"~dict.put(\\duration, {voice[i].duration});\n" + \
-                                    f"~dict.put(\\in, {voice[i].bus_in});\n" + \
-                                    f"~dict.put(\\levels, {voice[i].levels});\n" + \
-                                    f"~dict.put(\\out, {voice[i].bus_out});\n" + \
-                                    f"~dict.put(\\start, {voice[i].start_time});\n" + \
-                                    f"~dict.put(\\synth, \\dynamic{voice[i].synth});\n" + \
-                                    f"~dict.put(\\times, {voice[i].times});\n" + \
-                                    f"~dict.put(\\type, \\Dynamic);\n" + \
-                                    f"~{score_name}[{current_voice_index}].add(~dict);\n"
-                        elif type(voice[i]) == Effect:
-                            data += f"~dict = Dictionary.new;\n" + \
-                                    f"~dict.put(\\duration, {voice[i].duration});\n" + \
-                                    f"~dict.put(\\in, {voice[i].bus_in});\n" + \
-                                    f"~dict.put(\\out, {voice[i].bus_out});\n" + \
-                                    f"~dict.put(\\start, {voice[i].start_time});\n" + \
-                                    f"~dict.put(\\synth, \\effect{voice[i].synth});\n" + \
-                                    f"~dict.put(\\type, \\Effect);\n" + \
-                                    f"~{score_name}[{current_voice_index}].add(~dict);\n"
-                        elif type(voice[i]) == Pan:
-                            data += f"~dict = Dictionary.new;\n" + \
-                                    f"~dict.put(\\duration, {voice[i].duration});\n" + \
-                                    f"~dict.put(\\in, {voice[i].bus_in});\n" + \
-                                    f"~dict.put(\\pan2, {voice[i].pan2});\n" + \
-                                    f"~dict.put(\\panx, {voice[i].panx});\n" + \
-                                    f"~dict.put(\\panw, {voice[i].panw});\n" + \
-                                    f"~dict.put(\\start, {voice[i].start_time});\n" + \
-                                    f"~dict.put(\\type, \\Pan);\n" + \
-                                    f"~{score_name}[{current_voice_index}].add(~dict);\n"
-
-                    # If the flag test failed, we will stop adding notes, etc.
-                    else:
-                        idx[current_voice_index] = i
-                        break
-                current_voice_index += 1
-        num_measures_read += 1
-
-    data += ")\n"
-    score_list.append(data)
-    return score_list
-
-
-def dump_sc_to_file(file, new_parts, score_name):
-    """
-    Writes dumped SC data to a file
-    :param file: The file name
+    def open_chunk(chunk_index):
+        score_list.append(io.StringIO())
+        return contextlib.nullcontext(score_list[-1])
+
+    write_sc(new_parts, score_name, open_chunk, index)
+    return [score.getvalue() for score in score_list]
+
+
+def dump_sc_data_to_file(file, new_parts, score_name, index=None):
+    """
+    Writes the new part data in the compact SuperCollider data format. This produces a tab-separated data
+    file (file.tsv) with one row per event, and a small loader (file.scd) that reads it into ~score_name.
+    :param file: The file name, without extension
     :param new_parts: New (parsed) parts
-    :param score_name: The highest numbered measure
+    :param score_name: The name of the score variable in the SC file
+    :param index: An up-to-date index of the parts (see index_parts). If None, it will be built.
     :return:
     """
-    scores = dump_sc(new_parts, score_name)
-    if len(scores) > 1:
-        for i in range(len(scores)):
-            with open(f"{file}_{i}.scd", "w") as f:
-                f.write(scores[i])
+    with open(f"{file}.tsv", "w") as f:
+        write_sc_data(new_parts, f, index)
+    with open(f"{file}.scd", "w") as f:
+        f.write(SC_DATA_LOADER_TEMPLATE.format(data_file=os.path.basename(f"{file}.tsv"), name=score_name,
+                                               num_voices=sum(len(part) for part in new_parts)))
+
+
+def dump_sc_to_file(file, new_parts, score_name, index=None, incremental=False):
+    """
+    Writes dumped SC data to a file. The data is streamed to the file(s) rather than built in memory first.
+    Every export writes a manifest (file_manifest.tsv) that lists each chunk file with its SHA-1 hash, and a
+    loader (file_load.scd) that loads only the chunks whose hashes differ from the ones it loaded last time,
+    so re-running the loader after an export updates the score in SuperCollider without reloading it all.
+    Chunk files don't record how many chunks there are, so adding or removing a chunk leaves the others
+    unchanged. Chunk files listed in the previous manifest that this export doesn't write are deleted.
+    In incremental mode, each chunk is rendered in memory and hashed, and the file is only rewritten if its
+    hash differs from the one in the previous manifest.
+    :param file: The file name, without extension
+    :param new_parts: New (parsed) parts
+    :param score_name: The name of the score variable in the SC files
+    :param index: An up-to-date index of the parts (see index_parts). If None, it will be built.
+    :param incremental: Whether or not to skip rewriting unchanged chunks
+    :return: A list of the chunk files that were written by this call. This is every chunk file unless
+    incremental is True, in which case it is only the chunk files that changed.
+    """
+    if index is None:
+        index = index_parts(new_parts)
+    num_chunks = len(get_sc_chunks(get_highest_measure_no(new_parts, index)))
+    if num_chunks > 1:
+        names = [f"{file}_{i}.scd" for i in range(num_chunks)]
     else:
-        with open(f"{file}.scd", "w") as f:
-            f.write(scores[0])
+        names = [f"{file}.scd"]
+    old_hashes = read_sc_manifest(file)
+    manifest = []
+
+    @contextlib.contextmanager
+    def open_chunk(chunk_index):
+        name = os.path.basename(names[chunk_index])
+        if incremental:
+            # The chunk is rendered in memory so it can be hashed before deciding whether to write it
+            buffer = io.StringIO()
+            yield buffer
+            data = buffer.getvalue()
+            digest = hashlib.sha1(data.encode()).hexdigest()
+            changed = old_hashes.get(name) != digest or not os.path.exists(names[chunk_index])
+            if changed:
+                with open(names[chunk_index], "w") as f:
+                    f.write(data)
+        else:
+            with open(names[chunk_index], "w") as f:
+                writer = HashingWriter(f)
+                yield writer
+            digest = writer.hash.hexdigest()
+            changed = True
+        manifest.append((name, digest, changed))
+
+    write_sc(new_parts, score_name, open_chunk, index)
+    with open(f"{file}_manifest.tsv", "w") as f:
+        f.write("file\thash\tchanged\n")
+        for name, digest, changed in manifest:
+            f.write(f"{name}\t{digest}\t{int(changed)}\n")
+    with open(f"{file}_load.scd", "w") as f:
+        f.write(SC_MANIFEST_LOADER_TEMPLATE.format(manifest_file=os.path.basename(f"{file}_manifest.tsv"),
+                                                   name=score_name,
+                                                   num_voices=sum(len(part) for part in new_parts)))
+
+    # Delete the chunk files of the previous export that are no longer part of the score
+    current_names = {os.path.basename(name) for name in names}
+    for name in old_hashes:
+        stale_path = os.path.join(os.path.dirname(file), name)
+        if name not in current_names and os.path.exists(stale_path):
+            os.remove(stale_path)
+    return [names[i] for i in range(len(manifest)) if manifest[i][2]]
+
+
+def encode_sc_cell(value, kind):
+    """
+    Encodes a value for a cell in the compact SuperCollider data format. Numeric values that were never set
+    (empty sclang arrays such as "[[][][]]", the default envlen) are written as empty cells, so the key is
+    left out of the event's Dictionary.
+    :param value: The value
+    :param kind: The column kind (see SC_DATA_COLUMNS)
+    :return: The cell text
+    :raise ValueError: If the value can't be written as the column kind
+    """
+    if kind in ("i", "f") and type(value) == str and re.fullmatch(r"[\[\],\s]*", value):
+        return ""
+    elif kind == "i":
+        return str(int(value))
+    elif kind == "f":
+        return str(float(value))
+    elif kind == "a":
+        return " ".join(str(float(x)) for x in value)
+    elif kind == "n":
+        # Envelopes can be either sclang array strings or nested lists
+        if type(value) == str:
+            groups = re.findall(r"\[([^\[\]]*)]", value)
+            return "|".join(" ".join(group.replace(",", " ").split()) for group in groups)
+        return "|".join(" ".join(str(float(x)) for x in group) for group in value)
+    return str(value)
 
 
 def equal_loudness(note):
@@ -325,6 +556,33 @@ def equal_loudness(note):
     :param note: A Note
     :return: A mul value
     """
+    return equal_loudness_level(note.pitch.p)
+
+
+def equal_loudness_array(pitches):
+    """
+    Computes equal loudness mul values for many pitches at once, using a lookup table for the
+    24-EDO range from EQUAL_LOUDNESS_LOW to EQUAL_LOUDNESS_HIGH
+    :param pitches: A list or array of 24-EDO pitch integers, or a list of Pitch24 objects
+    :return: A NumPy array of mul values
+    """
+    if len(pitches) > 0 and isinstance(pitches[0], pitch.Pitch24):
+        pitches = [p.p for p in pitches]
+    pitches = np.asarray(pitches)
+    table = get_equal_loudness_table()
+    in_range = (pitches >= EQUAL_LOUDNESS_LOW) & (pitches <= EQUAL_LOUDNESS_HIGH) & (pitches == np.round(pitches))
+    levels = np.empty(pitches.shape)
+    levels[in_range] = table[pitches[in_range].astype(int) - EQUAL_LOUDNESS_LOW]
+    levels[~in_range] = [equal_loudness_level(p) for p in pitches[~in_range].tolist()]
+    return levels
+
+
+def equal_loudness_level(p):
+    """
+    Computes the equal loudness mul value for a pitch
+    :param p: A 24-EDO pitch integer
+    :return: A mul value
+    """
     # 20, 65
     # 50, 35
     # 100, 30 8x
@@ -334,7 +592,7 @@ def equal_loudness(note):
     # 5000, 5
     # 10000, 15
     note_level = 1
-    note_frequency = 440.0 * 2 ** ((note.pitch.p - 18) / 24)
+    note_frequency = 440.0 * 2 ** ((p - 18) / 24)
 
     # apply the equal loudness contour
     if note_frequency < 2000:
@@ -345,13 +603,28 @@ def equal_loudness(note):
     return note_level
 
 
-def get_highest_measure_no(parsed_parts):
+@functools.lru_cache(maxsize=None)
+def get_equal_loudness_table():
+    """
+    Gets the equal loudness lookup table. It is built on first use.
+    :return: A NumPy array of mul values for each pitch from EQUAL_LOUDNESS_LOW to EQUAL_LOUDNESS_HIGH
+    """
+    return np.array([equal_loudness_level(p) for p in range(EQUAL_LOUDNESS_LOW, EQUAL_LOUDNESS_HIGH + 1)])
+
+
+def get_highest_measure_no(parsed_parts, index=None):
     """
     Gets the highest measure number in a list of parts
     :param parsed_parts: A list of parsed parts
+    :param index: An optional index of the parts (see index_parts)
     :return: The highest measure number
     """
     num_measures = 0
+    if index is not None:
+        for part in index:
+            for voice_index in part:
+                num_measures = max(num_measures, voice_index.highest_measure)
+        return num_measures
     for part in parsed_parts:
         for voice in part:
             for note in voice:
@@ -361,12 +634,107 @@ def get_highest_measure_no(parsed_parts):
     return num_measures
 
 
-def parse_parts(parts, part_indices=None):
+@functools.lru_cache(maxsize=None)
+def get_pitch24_number(step, alter, octave):
+    """
+    Gets the 24-EDO pitch integer for a note name. Results are cached, since scores spell the same pitches
+    over and over.
+    :param step: The step name (C, D, E, etc.)
+    :param alter: The accidental alteration in semitones
+    :param octave: The octave number
+    :return: The pitch integer
+    """
+    return MAP24[step] + int(2 * alter) + PC24 * (octave - 4)
+
+
+def get_sc_chunks(num_measures):
+    """
+    Gets the measure ranges for each SuperCollider score file. A new file is started once more than
+    SC_CHUNK_MEASURES measures have been written to the current file.
+    :param num_measures: The highest measure number
+    :return: A list of (first measure, last measure) tuples
+    """
+    chunk_length = SC_CHUNK_MEASURES + 1
+    return [(first, min(first + chunk_length - 1, num_measures)) for first in range(0, num_measures + 1, chunk_length)]
+
+
+def get_sc_row(item, i, v):
+    """
+    Gets the compact SuperCollider data for an event. The keys match those written by the event templates.
+    :param item: A Note, Sound, Dynamic, Effect, or Pan
+    :param i: The index of the event in its voice
+    :param v: The voice index
+    :return: A dictionary of column key -> value, or None if the event is not written to the score
+    """
+    if type(item) == Note:
+        if item.synth == 0:
+            return {"i0": v, "i1": i, "buf0": item.buffer, "buf1": 1, "duration": item.duration, "env": item.env,
+                    "envlen": item.envlen, "measure": item.measure, "mul": item.mul, "out": item.bus_out,
+                    "pitch": item.pitch.p, "start": item.start_time, "synth": f"synth{item.synth}_{item.envlen}",
+                    "type": "Granular", "wait": item.wait}
+        elif item.synth >= 10:
+            return {"i0": v, "i1": i, "buf": item.buffer, "mod_curves": item.mod_curves, "duration": item.duration,
+                    "env": item.env, "envlen": item.envlen, "mod_levels": item.mod_levels, "measure": item.measure,
+                    "mul": item.mul, "out": item.bus_out, "pitch": item.pitch.p, "start": item.start_time,
+                    "synth": f"synth{item.synth}_{item.envlen}", "mod_times": item.mod_times, "type": "FM",
+                    "wait": item.wait}
+    elif type(item) == Sound:
+        return {"i0": v, "i1": i, "buf": item.buffer, "duration": item.duration, "env": item.env,
+                "envlen": item.envlen, "measure": item.measure, "mul": item.mul, "out": item.bus_out,
+                "pitch": item.pitch.p, "rate": 1, "start": item.start_time, "synth": str(item.synth).lstrip("\\"),
+                "type": "Sound", "wait": item.wait}
+    elif type(item) == Dynamic:
+        return {"curves": item.curves, "duration": item.duration, "in": item.bus_in, "levels": item.levels,
+                "out": item.bus_out, "start": item.start_time, "synth": f"dynamic{item.synth}", "times": item.times,
+                "type": "Dynamic"}
+    elif type(item) == Effect:
+        return {"duration": item.duration, "in": item.bus_in, "out": item.bus_out, "start": item.start_time,
+                "synth": f"effect{item.synth}", "type": "Effect"}
+    elif type(item) == Pan:
+        return {"duration": item.duration, "in": item.bus_in, "pan2": item.pan2, "panx": item.panx,
+                "panw": item.panw, "start": item.start_time, "type": "Pan"}
+    return None
+
+
+def get_sc_template(item):
+    """
+    Gets the SuperCollider template for an event
+    :param item: A Note, Sound, Dynamic, Effect, or Pan
+    :return: The template, or None if the event is not written to the score
+    """
+    if type(item) == Note:
+        if item.synth == 0:
+            return SC_GRANULAR_TEMPLATE
+        elif item.synth >= 10:
+            return SC_FM_TEMPLATE
+    elif type(item) == Sound:
+        return SC_SOUND_TEMPLATE
+    elif type(item) == Dynamic:
+        return SC_DYNAMIC_TEMPLATE
+    elif type(item) == Effect:
+        return SC_EFFECT_TEMPLATE
+    elif type(item) == Pan:
+        return SC_PAN_TEMPLATE
+    return None
+
+
+def index_parts(parsed_parts):
+    """
+    Builds a VoiceIndex for each voice in a list of parsed parts. The index must be rebuilt if items are
+    inserted into or removed from the voices.
+    :param parsed_parts: A list of parsed parts
+    :return: A list of lists of VoiceIndex objects, matching the layout of the parts
+    """
+    return [[VoiceIndex(voice) for voice in part] for part in parsed_parts]
+
+
+def parse_parts(parts, part_indices=None, index=False):
     """
     Parses parts
     :param parts: A list of parts
     :param part_indices: The indices of parts to use. If None, extracts all parts.
-    :return:
+    :param index: Whether or not to also return a VoiceIndex for each voice (see index_parts)
+    :return: The parsed parts, or a tuple of the parsed parts and their index
     """
     new_parts = []  # The new list of parts
     indices = [i for i in range(len(parts))]  # The list of part indices to parse
@@ -608,6 +976,8 @@ def parse_parts(parts, part_indices=None):
             for subvoice in voice:
                 part2.append(subvoice)
         new_parts2.append(part2)
+    if index:
+        return new_parts2, index_parts(new_parts2)
     return new_parts2
 
 
@@ -625,6 +995,98 @@ def read_file(input_xml):
     return parts
 
 
+def read_sc_manifest(file):
+    """
+    Reads the chunk hashes recorded by a dump_sc_to_file export
+    :param file: The file name passed to dump_sc_to_file
+    :return: A dictionary of chunk file name -> hash. It is empty if there is no manifest.
+    """
+    hashes = {}
+    if os.path.exists(f"{file}_manifest.tsv"):
+        with open(f"{file}_manifest.tsv", "r") as f:
+            for line in f.readlines()[1:]:
+                columns = line.rstrip("\n").split("\t")
+                if len(columns) >= 2:
+                    hashes[columns[0]] = columns[1]
+    return hashes
+
+
+def write_sc(new_parts, score_name, open_chunk, index=None):
+    """
+    Streams the new part data in SuperCollider format. Each chunk of measures (see get_sc_chunks) is written
+    to its own file, one event at a time, so the score is never held in memory. Each chunk owns its slice of
+    the score: it replaces ~score_name_chunks[chunk] with new lists for each voice, adds its events to them,
+    and then rebuilds ~score_name[voice] from the chunks that have been loaded. A chunk can therefore be
+    reloaded on its own, in any order, without duplicating events. Chunks only refer to their own index, not
+    to the number of chunks, so a chunk's text doesn't change when chunks are added or removed.
+    :param new_parts: New (parsed) parts
+    :param score_name: The name of the score variable in the SC file
+    :param open_chunk: A function that takes a chunk index and returns a context manager for a writable text file
+    :param index: An up-to-date index of the parts (see index_parts). If None, it will be built.
+    :return: The number of chunks written
+    """
+    if index is None:
+        index = index_parts(new_parts)
+    voices = [voice for part in new_parts for voice in part]
+    voice_indices = [voice_index for part in index for voice_index in part]
+    chunks = get_sc_chunks(get_highest_measure_no(new_parts, index))
+    chunks_name = f"{score_name}_chunks"
+
+    for chunk_index, (first_measure, last_measure) in enumerate(chunks):
+        with open_chunk(chunk_index) as f:
+            write = f.write
+            write("(\n")
+            write(f"~{chunks_name} = ~{chunks_name} ?? {{[]}};\n")
+            write(f"if(~{chunks_name}.size <= {chunk_index}, "
+                  f"{{~{chunks_name} = ~{chunks_name}.extend({chunk_index + 1}, nil)}});\n")
+            write(f"~{chunks_name}[{chunk_index}] = Array.fill({len(voices)}, {{List.new}});\n")
+            name = f"{chunks_name}[{chunk_index}]"
+            for measure_no in range(first_measure, last_measure + 1):
+                for v, voice in enumerate(voices):
+                    write(f"// Measure {measure_no}, Voice {v}\n")
+                    for i in voice_indices[v].get_measure(measure_no):
+                        template = get_sc_template(voice[i])
+                        if template is not None:
+                            write(template.format(e=voice[i], i=i, v=v, name=name))
+            write(f"~{score_name} = Array.fill({len(voices)}, {{|v|\n"
+                  f"    var events = List.new;\n"
+                  f"    ~{chunks_name}.do({{|chunk| if(chunk.notNil, {{events.addAll(chunk[v])}})}});\n"
+                  f"    events;\n"
+                  f"}});\n")
+            write(")\n")
+    return len(chunks)
+
+
+def write_sc_data(new_parts, file, index=None):
+    """
+    Streams the new part data to a file in the compact SuperCollider data format. The first row is a header
+    of key:kind columns (see SC_DATA_COLUMNS), and each following row is one event, preceded by its voice index.
+    Empty cells are left out of the event's Dictionary when it is loaded.
+    :param new_parts: New (parsed) parts
+    :param file: A writable text file
+    :param index: An up-to-date index of the parts (see index_parts). If None, it will be built.
+    :return:
+    """
+    if index is None:
+        index = index_parts(new_parts)
+    voices = [voice for part in new_parts for voice in part]
+    voice_indices = [voice_index for part in index for voice_index in part]
+    file.write("\t".join(["v"] + [f"{key}:{kind}" for key, kind in SC_DATA_COLUMNS]) + "\n")
+    for measure_no in range(get_highest_measure_no(new_parts, index) + 1):
+        for v, voice in enumerate(voices):
+            for i in voice_indices[v].get_measure(measure_no):
+                row = get_sc_row(voice[i], i, v)
+                if row is not None:
+                    cells = [str(v)]
+                    for key, kind in SC_DATA_COLUMNS:
+                        try:
+                            cells.append(encode_sc_cell(row[key], kind) if key in row else "")
+                        except (TypeError, ValueError):
+                            raise ValueError(f"Voice {v}, event {i}: the {key} value {row[key]!r} can't be "
+                                             f"written as kind {kind} (see SC_DATA_COLUMNS)")
+                    file.write("\t".join(cells) + "\n")
+
+
 def write_to_file(data, file):
     """
     Writes dumped data to a file
@@ -14,6 +14,12 @@ from pctheory import pitch
 MAP12 = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
 PC12 = 12
 
+# The longest repeated sub-pattern to look for when compressing Pseq lists
+MAX_PATTERN_LENGTH = 8
+
+# The approximate number of characters added by writing a sub-pattern as Pseq([...], n)
+PATTERN_OVERHEAD = 12
+
 
 class PbindNote:
     """
@@ -38,41 +44,69 @@ class PbindRest:
         self.quarterLength = kwargs["quarterLength"] if "quarterLength" in kwargs else 1
 
 
+def compress_pattern(values, max_length=MAX_PATTERN_LENGTH):
+    """
+    Compresses a list of SuperCollider pattern values by finding runs of repeated values and repeated
+    sub-patterns. Sub-patterns are compressed recursively, so the result can be nested.
+    :param values: A list of value strings
+    :param max_length: The longest sub-pattern to look for
+    :return: A list of items. Each item is either a value string or a (sub-pattern items, repeats) tuple.
+    """
+    items = []
+    i = 0
+    while i < len(values):
+        # Find the sub-pattern starting here that saves the most space when written as a repeat
+        best_savings = 0
+        best_length = 0
+        best_repeats = 0
+        for length in range(1, min(max_length, (len(values) - i) // 2) + 1):
+            repeats = 1
+            while values[i + repeats * length:i + (repeats + 1) * length] == values[i:i + length]:
+                repeats += 1
+            if repeats > 1:
+                savings = sum(len(value) + 2 for value in values[i:i + length]) * (repeats - 1) - PATTERN_OVERHEAD
+                if savings > best_savings:
+                    best_savings = savings
+                    best_length = length
+                    best_repeats = repeats
+        if best_length:
+            items.append((compress_pattern(values[i:i + best_length], max_length), best_repeats))
+            i += best_length * best_repeats
+        else:
+            items.append(values[i])
+            i += 1
+    return items
+
+
 def dump_sc(new_parts):
     """
-    Dumps the new part data in SuperCollider format
+    Dumps the new part data in SuperCollider format. Repeated durations and pitches are written as
+    Pn and nested Pseq patterns (see compress_pattern).
     :param new_parts: New (parsed) parts
     :return:
     """
-    data = "~score = [\n"
+    data = ["~score = [\n"]
     for p in new_parts:
         for v in p:
             for v2 in v:
                 if len(v2) > 0:
-                    data += "    Pbind(\n        \\instrument, Pseq([\\wt], inf),\n        \\dur, Pseq([\n            "
-                    for i in range(len(v2) - 1):
-                        if type(v2[i]) == PbindNote:
-                            data += f"{v2[i].quarterLength.numerator}/{v2[i].quarterLength.denominator}, "
+                    durations = []
+                    midinotes = []
+                    for item in v2:
+                        if type(item) == PbindNote:
+                            durations.append(f"{item.quarterLength.numerator}/{item.quarterLength.denominator}")
+                            midinotes.append(f"{item.midi}")
                         else:
-                            data += f"Rest({v2[i].quarterLength.numerator}/{v2[i].quarterLength.denominator}), "
-                    if type(v2[len(v2) - 1]) == PbindNote:
-                        data += f"{v2[len(v2) - 1].quarterLength.numerator}/{v2[len(v2) - 1].quarterLength.denominator}"
-                    else:
-                        data += f"Rest({v2[len(v2) - 1].quarterLength.numerator}/{v2[len(v2) - 1].quarterLength.denominator})"
-                    data += "\n        ], 1),\n"
-                    data += "\n        \\amp, Pseq([0.3], inf),\n        \\midinote, Pseq([\n            "
-                    for i in range(len(v2) - 1):
-                        if type(v2[i]) == PbindNote:
-                            data += f"{v2[i].midi}, "
-                        else:
-                            data += "0, "
-                    if type(v2[len(v2) - 1]) == PbindNote:
-                        data += f"{v2[len(v2) - 1].midi}"
-                    else:
-                        data += "0"
-                    data += "\n        ], 1),\n        \\legato, 1.05\n    ),\n"
-    data += "];\n"
-    return data
+                            durations.append(f"Rest({item.quarterLength.numerator}/{item.quarterLength.denominator})")
+                            midinotes.append("0")
+                    data.append("    Pbind(\n        \\instrument, Pseq([\\wt], inf),\n        \\dur, Pseq([\n            ")
+                    write_pattern(compress_pattern(durations), data.append)
+                    data.append("\n        ], 1),\n")
+                    data.append("\n        \\amp, Pseq([0.3], inf),\n        \\midinote, Pseq([\n            ")
+                    write_pattern(compress_pattern(midinotes), data.append)
+                    data.append("\n        ], 1),\n        \\legato, 1.05\n    ),\n")
+    data.append("];\n")
+    return "".join(data)
 
 
 def dump_sc_to_file(file, new_parts):
@@ -88,6 +122,21 @@ def dump_sc_to_file(file, new_parts):
         f.write(dump_sc(new_parts))
 
 
+def expand_pattern(items):
+    """
+    Expands a compressed pattern (see compress_pattern) back into a list of values
+    :param items: The compressed pattern
+    :return: A list of value strings
+    """
+    values = []
+    for item in items:
+        if type(item) == tuple:
+            values.extend(expand_pattern(item[0]) * item[1])
+        else:
+            values.append(item)
+    return values
+
+
 def parse_parts(parts, part_indices=None):
     """
     Parses parts
@@ -310,3 +359,68 @@ def read_file(input_xml):
         if type(item) == music21.stream.Part or type(item) == music21.stream.PartStaff:
             parts.append(item)
     return parts
+
+
+def test():
+    """
+    Tests that compressed patterns expand back to the original values, and that the SuperCollider text
+    written for them has the expected Pn and nested Pseq patterns
+    :return:
+    """
+    values = ["1/4", "1/4", "1/4", "1/4", "1/8", "1/8", "Rest(1/2)", "1/8", "1/8", "Rest(1/2)", "1/8", "1/8",
+              "Rest(1/2)", "3/4", "1/4", "1/4", "1/2", "1/4", "1/4", "1/2"]
+    assert expand_pattern(compress_pattern(values)) == values
+    assert expand_pattern(compress_pattern(values, 1)) == values
+    assert expand_pattern(compress_pattern([])) == []
+    data = []
+    write_pattern(compress_pattern(["60" for i in range(16)]), data.append)
+    assert "".join(data) == "Pn(60, 16)"
+
+    # A repeated sub-pattern that contains its own repeat is written as a nested Pseq
+    data = []
+    values = (["60"] + ["62" for i in range(6)]) * 3 + ["67"]
+    write_pattern(compress_pattern(values), data.append)
+    assert "".join(data) == "Pseq([60, Pn(62, 6)], 3), 67"
+    data = []
+    write_pattern(compress_pattern(["1/4", "1/8", "1/8", "1/4", "1/8", "1/8", "1/2"]), data.append)
+    assert "".join(data) == "Pseq([1/4, 1/8, 1/8], 2), 1/2"
+
+    # The durations and midinotes of a voice are compressed separately and joined into one Pbind
+    notes = [PbindNote(midi=60, quarterLength=Fraction(1, 2)) for i in range(8)]
+    notes += [PbindRest(quarterLength=Fraction(2)), PbindNote(midi=67, quarterLength=Fraction(2))]
+    assert dump_sc([[[notes]]]) == ("~score = [\n"
+                                    "    Pbind(\n"
+                                    "        \\instrument, Pseq([\\wt], inf),\n"
+                                    "        \\dur, Pseq([\n"
+                                    "            Pn(1/2, 8), Rest(2/1), 2/1\n"
+                                    "        ], 1),\n"
+                                    "\n"
+                                    "        \\amp, Pseq([0.3], inf),\n"
+                                    "        \\midinote, Pseq([\n"
+                                    "            Pn(60, 8), 0, 67\n"
+                                    "        ], 1),\n"
+                                    "        \\legato, 1.05\n"
+                                    "    ),\n"
+                                    "];\n")
+    assert dump_sc([[[[]]]]) == "~score = [\n];\n"
+
+
+def write_pattern(items, write):
+    """
+    Writes a compressed pattern (see compress_pattern) as the contents of a SuperCollider list
+    :param items: The compressed pattern
+    :param write: A function that writes a string (such as list.append or file.write)
+    :return:
+    """
+    for i, item in enumerate(items):
+        if i > 0:
+            write(", ")
+        if type(item) == tuple:
+            if len(item[0]) == 1 and type(item[0][0]) == str:
+                write(f"Pn({item[0][0]}, {item[1]})")
+            else:
+                write("Pseq([")
+                write_pattern(item[0], write)
+                write(f"], {item[1]})")
+        else:
+            write(item)
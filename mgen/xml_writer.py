@@ -0,0 +1,442 @@
+"""
+Name: xml_writer.py
+Author: Jeff Martin
+Email: jeffreymartin@outlook.com
+
+This file contains a lightweight MusicXML writer for generated scores. It writes parts, measures, notes,
+ties, and lyrics directly from compact (pitches, quarter duration) sequences, streaming the output to
+the file as it goes, so it never builds music21 objects. The compact sequence helpers used by xml_gen
+also live here because they don't need music21.
+"""
+
+from fractions import Fraction
+import math
+import numpy
+from xml.sax.saxutils import XMLGenerator
+
+from pctheory import pitch
+
+# Note types and their quarter durations, from longest to shortest
+NOTE_TYPES = [("breve", Fraction(8)), ("whole", Fraction(4)), ("half", Fraction(2)), ("quarter", Fraction(1)),
+              ("eighth", Fraction(1, 2)), ("16th", Fraction(1, 4)), ("32nd", Fraction(1, 8)),
+              ("64th", Fraction(1, 16))]
+
+# Spellings for each pitch class, as (step, alter)
+PC_SPELLINGS = [("C", 0), ("C", 1), ("D", 0), ("E", -1), ("E", 0), ("F", 0), ("F", 1), ("G", 0), ("G", 1),
+                ("A", 0), ("B", -1), ("B", 0)]
+
+CLEFS = {"treble": ("G", 2), "bass": ("F", 4), "alto": ("C", 3), "tenor": ("C", 4)}
+
+
+class XmlPart:
+    """
+    Represents a part to write with the MusicXML writer
+    """
+    def __init__(self, **kwargs):
+        """
+        Creates an XmlPart
+        :param kwargs: name, abbreviation, items (compact tuples), lyrics, clef
+        """
+        self.name = kwargs["name"] if "name" in kwargs else "Part"
+        self.abbreviation = kwargs["abbreviation"] if "abbreviation" in kwargs else ""
+        self.items = kwargs["items"] if "items" in kwargs else []
+        self.lyrics = kwargs["lyrics"] if "lyrics" in kwargs else None
+        self.clef = kwargs["clef"] if "clef" in kwargs else "treble"
+
+
+class XmlStreamWriter:
+    """
+    Writes indented XML elements to a file one at a time
+    """
+    def __init__(self, file):
+        """
+        Creates an XmlStreamWriter
+        :param file: A file opened for writing text
+        """
+        self._generator = XMLGenerator(file, "UTF-8", short_empty_elements=True)
+        self._depth = 0
+        self._open_children = False
+
+    def element(self, name, text=None, attrs=None):
+        """
+        Writes an element with optional text content
+        :param name: The element name
+        :param text: The text content
+        :param attrs: A dictionary of attributes
+        :return:
+        """
+        self.indent()
+        self._generator.startElement(name, attrs if attrs is not None else {})
+        if text is not None:
+            self._generator.characters(str(text))
+        self._generator.endElement(name)
+        self._open_children = True
+
+    def end(self, name):
+        """
+        Closes an element
+        :param name: The element name
+        :return:
+        """
+        self._depth -= 1
+        if self._open_children:
+            self.indent()
+        self._generator.endElement(name)
+        self._open_children = True
+
+    def end_document(self):
+        """
+        Finishes the document
+        :return:
+        """
+        self._generator.ignorableWhitespace("\n")
+        self._generator.endDocument()
+
+    def indent(self):
+        """
+        Starts a new line at the current depth
+        :return:
+        """
+        self._generator.ignorableWhitespace("\n" + "  " * self._depth)
+        self._open_children = True
+
+    def start(self, name, attrs=None):
+        """
+        Opens an element
+        :param name: The element name
+        :param attrs: A dictionary of attributes
+        :return:
+        """
+        self.indent()
+        self._generator.startElement(name, attrs if attrs is not None else {})
+        self._depth += 1
+        self._open_children = False
+
+    def start_document(self, doctype=None):
+        """
+        Starts the document
+        :param doctype: A DOCTYPE declaration to write after the XML declaration
+        :return:
+        """
+        self._generator.startDocument()
+        if doctype is not None:
+            self._generator.ignorableWhitespace(doctype)
+        self._depth = 0
+        self._open_children = True
+
+
+def get_bar_splits(durations, bar_lengths):
+    """
+    Splits a sequence of durations at the bar lines, the same way add_sequence does
+    :param durations: A list of quarter durations
+    :param bar_lengths: The available quarter duration of each measure, starting with the first measure to fill
+    :return: A list of fragments. Each fragment is a tuple (item index, measure index, offset, duration, tie), where
+    tie is "start", "continue", "stop", or None if the item is not split.
+    """
+    fragments = []
+    m = 0               # The current measure index
+    current_offset = 0  # The offset for the next fragment
+    for i, total_duration in enumerate(durations):
+        remaining_duration = total_duration
+        while remaining_duration > 0:
+            if bar_lengths[m] - current_offset >= remaining_duration:
+                new_item_duration = remaining_duration
+            else:
+                new_item_duration = bar_lengths[m] - current_offset
+
+            if remaining_duration == total_duration and new_item_duration < total_duration:
+                tie = "start"
+            elif total_duration > remaining_duration > new_item_duration:
+                tie = "continue"
+            elif total_duration > remaining_duration == new_item_duration:
+                tie = "stop"
+            else:
+                tie = None
+            fragments.append((i, m, current_offset, new_item_duration, tie))
+
+            current_offset += new_item_duration
+            remaining_duration -= new_item_duration
+            if current_offset >= bar_lengths[m]:
+                m += 1
+                current_offset = 0
+    return fragments
+
+
+def get_divisions(lengths):
+    """
+    Gets the number of MusicXML divisions per quarter note needed to represent a set of durations exactly
+    :param lengths: An iterable of quarter durations, as Fractions
+    :return: The number of divisions
+    """
+    divisions = 1
+    for length in lengths:
+        divisions = math.lcm(divisions, length.denominator)
+    return divisions
+
+
+def get_note_types(duration):
+    """
+    Splits a quarter duration into notatable pieces, using plain, dotted, and double-dotted note types
+    :param duration: The quarter duration
+    :return: A list of (type, dots, quarter duration) tuples. Durations that can't be notated with note types
+    (such as tuplet durations) are returned as a single piece with type None.
+    """
+    remaining = Fraction(duration).limit_denominator(1024)
+    if remaining.denominator & (remaining.denominator - 1) != 0:
+        return [(None, 0, remaining)]
+    pieces = []
+    while remaining > 0:
+        for note_type, length in NOTE_TYPES:
+            piece = None
+            for dots, dotted_length in ((2, length * Fraction(7, 4)), (1, length * Fraction(3, 2)), (0, length)):
+                if dotted_length <= remaining:
+                    piece = (note_type, dots, dotted_length)
+                    break
+            if piece is not None:
+                pieces.append(piece)
+                remaining -= piece[2]
+                break
+        else:
+            pieces.append((None, 0, remaining))
+            remaining = 0
+    return pieces
+
+
+def get_pitch_spelling(midi):
+    """
+    Spells a MIDI note number for MusicXML. Quarter tones are spelled with an alter of +0.5.
+    :param midi: The MIDI note number
+    :return: A tuple (step, alter, octave)
+    """
+    base = math.floor(midi)
+    step, alter = PC_SPELLINGS[base % 12]
+    alter += midi - base
+    return step, alter, base // 12 - 1
+
+
+def make_compact_list(items, durations):
+    """
+    Makes a compact list of (pitches, quarter duration) tuples from the same items that make_music21_list takes.
+    The pitches are a tuple of MIDI note numbers: empty for a rest, one for a note, and several for a chord.
+    :param items: A list of items
+    :param durations: A list of quarter durations
+    :return: A list of compact tuples
+    """
+    c_list = []
+    if len(items) == len(durations):
+        for i in range(len(items)):
+            current_item = items[i]
+            current_duration = durations[i]
+
+            # Handles chords
+            if type(current_item) == set:
+                current_item = list(current_item)
+            if type(current_item) == list:
+                if len(current_item) == 0:
+                    c_list.append(((), current_duration))
+                elif type(current_item[0]) == int or type(current_item[0]) == float:
+                    c_list.append((tuple(j + 60 for j in current_item), current_duration))
+                elif type(current_item[0]) == pitch.Pitch:
+                    c_list.append((tuple(p.p / (p.mod / 12) + 60 for p in current_item), current_duration))
+
+            elif type(current_item) == float or type(current_item) == int:
+                if current_item == -numpy.inf:
+                    c_list.append(((), current_duration))
+                else:
+                    c_list.append(((current_item + 60,), current_duration))
+
+            elif type(current_item) == pitch.Pitch:
+                c_list.append(((current_item.p / (current_item.mod / 12) + 60,), current_duration))
+    return c_list
+
+
+def write_attributes(writer, divisions, key, beats, beat_type, clef):
+    """
+    Writes the attributes for the first measure of a part
+    :param writer: The XmlStreamWriter
+    :param divisions: The number of divisions per quarter note
+    :param key: The key signature, as a number of sharps or flats
+    :param beats: The time signature numerator
+    :param beat_type: The time signature denominator
+    :param clef: The clef name
+    :return:
+    """
+    sign, line = CLEFS[clef]
+    writer.start("attributes")
+    writer.element("divisions", divisions)
+    writer.start("key")
+    writer.element("fifths", key)
+    writer.end("key")
+    writer.start("time")
+    writer.element("beats", beats)
+    writer.element("beat-type", beat_type)
+    writer.end("time")
+    writer.start("clef")
+    writer.element("sign", sign)
+    writer.element("line", line)
+    writer.end("clef")
+    writer.end("attributes")
+
+
+def write_fragment(writer, part, fragment, pieces, divisions):
+    """
+    Writes one bar fragment of an item as one or more notes, rests, or chords
+    :param writer: The XmlStreamWriter
+    :param part: The XmlPart
+    :param fragment: The fragment, from get_bar_splits
+    :param pieces: The notatable pieces of the fragment, from get_note_types
+    :param divisions: The number of divisions per quarter note
+    :return:
+    """
+    i, m, offset, duration, tie = fragment
+    pitches = part.items[i][0]
+    for j, (note_type, dots, length) in enumerate(pieces):
+        tie_stop = j > 0 or tie == "continue" or tie == "stop"
+        tie_start = j < len(pieces) - 1 or tie == "start" or tie == "continue"
+        for k in range(max(len(pitches), 1)):
+            writer.start("note")
+            if k > 0:
+                writer.element("chord")
+            if len(pitches) == 0:
+                writer.element("rest")
+            else:
+                step, alter, octave = get_pitch_spelling(pitches[k])
+                writer.start("pitch")
+                writer.element("step", step)
+                if alter != 0:
+                    writer.element("alter", alter)
+                writer.element("octave", octave)
+                writer.end("pitch")
+            writer.element("duration", int(length * divisions))
+            if len(pitches) > 0:
+                if tie_stop:
+                    writer.element("tie", attrs={"type": "stop"})
+                if tie_start:
+                    writer.element("tie", attrs={"type": "start"})
+            if note_type is not None:
+                writer.element("type", note_type)
+                for d in range(dots):
+                    writer.element("dot")
+            if len(pitches) > 0 and (tie_stop or tie_start):
+                writer.start("notations")
+                if tie_stop:
+                    writer.element("tied", attrs={"type": "stop"})
+                if tie_start:
+                    writer.element("tied", attrs={"type": "start"})
+                writer.end("notations")
+
+            # Lyrics go on the first note of the item
+            if k == 0 and j == 0 and part.lyrics is not None and (tie is None or tie == "start"):
+                lyrics = part.lyrics[i] if type(part.lyrics[i]) == list else [part.lyrics[i]]
+                for n, text in enumerate(lyrics):
+                    writer.start("lyric", {"number": str(n + 1)})
+                    writer.element("syllabic", "single")
+                    writer.element("text", text)
+                    writer.end("lyric")
+            writer.end("note")
+
+
+def write_rest(writer, note_type, dots, length, divisions):
+    """
+    Writes a rest
+    :param writer: The XmlStreamWriter
+    :param note_type: The note type (if None, no type is written)
+    :param dots: The number of dots
+    :param length: The quarter duration
+    :param divisions: The number of divisions per quarter note
+    :return:
+    """
+    writer.start("note")
+    writer.element("rest")
+    writer.element("duration", int(length * divisions))
+    if note_type is not None:
+        writer.element("type", note_type)
+        for d in range(dots):
+            writer.element("dot")
+    writer.end("note")
+
+
+def write_score(path, parts, title="Score", composer="Jeff Martin", num_measures=None, key=0,
+                time_signature="4/4"):
+    """
+    Writes a score to a MusicXML file without building music21 objects. Each item of each part is split at
+    the bar lines the same way add_sequence splits it, and notes that don't fit a single note type are
+    written as several tied notes. Measures that a part doesn't reach get measure rests, and the rest of a
+    measure that a part only partly fills is padded with rests.
+    :param path: The path
+    :param parts: A list of XmlParts
+    :param title: The title of the score
+    :param composer: The composer name
+    :param num_measures: The number of measures to write (if None, just enough for the longest part)
+    :param key: The key signature, as a number of sharps (positive) or flats (negative)
+    :param time_signature: The time signature to use
+    :return:
+    """
+    beats, beat_type = [int(x) for x in time_signature.split("/")]
+    bar_duration = Fraction(beats * 4, beat_type)
+
+    # Find the bar splits for each part. This only needs the durations.
+    part_fragments = []
+    for part in parts:
+        durations = [Fraction(item[1]).limit_denominator(1024) for item in part.items]
+        bar_lengths = [bar_duration] * (int(sum(durations) / bar_duration) + 1)
+        part_fragments.append(get_bar_splits(durations, bar_lengths))
+    if num_measures is None:
+        num_measures = max([fragments[-1][1] + 1 for fragments in part_fragments if len(fragments) > 0],
+                           default=1)
+    part_pieces = [[get_note_types(fragment[3]) for fragment in fragments] for fragments in part_fragments]
+
+    # The rests that pad the last measure of each part out to the full bar
+    part_padding = []
+    for fragments in part_fragments:
+        if len(fragments) > 0 and fragments[-1][2] + fragments[-1][3] < bar_duration:
+            part_padding.append(get_note_types(bar_duration - fragments[-1][2] - fragments[-1][3]))
+        else:
+            part_padding.append([])
+    divisions = get_divisions([bar_duration] + [piece[2] for pieces in part_pieces for fragment_pieces in pieces
+                                                for piece in fragment_pieces] +
+                              [piece[2] for padding in part_padding for piece in padding])
+
+    with open(path, "w", encoding="utf-8") as file:
+        writer = XmlStreamWriter(file)
+        writer.start_document('<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+                              '"http://www.musicxml.org/dtds/partwise.dtd">')
+        writer.start("score-partwise", {"version": "4.0"})
+        writer.start("work")
+        writer.element("work-title", title)
+        writer.end("work")
+        writer.start("identification")
+        writer.element("creator", composer, {"type": "composer"})
+        writer.end("identification")
+        writer.start("part-list")
+        for i, part in enumerate(parts):
+            writer.start("score-part", {"id": f"P{i + 1}"})
+            writer.element("part-name", part.name)
+            if part.abbreviation:
+                writer.element("part-abbreviation", part.abbreviation)
+            writer.end("score-part")
+        writer.end("part-list")
+
+        for i, part in enumerate(parts):
+            writer.start("part", {"id": f"P{i + 1}"})
+            fragments = part_fragments[i]
+            f = 0
+            for m in range(num_measures):
+                writer.start("measure", {"number": str(m + 1)})
+                if m == 0:
+                    write_attributes(writer, divisions, key, beats, beat_type, part.clef)
+                if f >= len(fragments) or fragments[f][1] > m:
+                    writer.start("note")
+                    writer.element("rest", attrs={"measure": "yes"})
+                    writer.element("duration", int(bar_duration * divisions))
+                    writer.end("note")
+                while f < len(fragments) and fragments[f][1] == m:
+                    write_fragment(writer, part, fragments[f], part_pieces[i][f], divisions)
+                    f += 1
+                    if f == len(fragments):
+                        for note_type, dots, length in part_padding[i]:
+                            write_rest(writer, note_type, dots, length, divisions)
+                writer.end("measure")
+            writer.end("part")
+        writer.end("score-partwise")
+        writer.end_document()
@@ -5,17 +5,34 @@ Date: 3/14/24
 This file contains standard functionality for interactive pctheory calculations.
 """
 
-import pctheory.pitch as pitch
-import pctheory.pcset as pcset
-import pctheory.transformations as transformations
+import argparse
+import functools
+import json
+import sys
 
 HEX_MAP = {'0': 0, '1': 1, '2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, 'a': 10, 'b': 11, 'c': 12, 'd': 13, 'e': 14, 'f': 15}
+HEX_CHARS = "0123456789ABCDEF"
+
+# The largest mod value that fits in the set-class table masks
+MAX_MOD = 31
+
+# Short command names and their full names
+COMMAND_NAMES = {"a": "about", "c": "calculate", "x": "exit", "n": "info", "l": "load", "q": "quit", "h": "search",
+                 "s": "subsets", "sp": "subsets prime"}
+
+# The number of batch commands to send to a worker process at once
+BATCH_CHUNK_SIZE = 64
 
 VALID_COMMANDS = {"about", "a", "calculate", "c", "exit", "x", "info", "n", "load", "l", "mod", "quit", "q", "search", "h", "subsets", "s", "subsets prime", "sp"}
 NON_NUMERIC_TRANSFORMATIONS = {"I"}
 NUMERIC_TRANSFORMATIONS = {"T", "M"}
 VALID_TRANSFORMATIONS = NUMERIC_TRANSFORMATIONS.union(NON_NUMERIC_TRANSFORMATIONS)
-sc = pcset.SetClass(pc_mod=12)
+
+# The set class is stored as the mask of its prime form (bit n is set if pitch class n is present).
+# The set-class tables and pctheory are only imported when a command needs them, so the calculator
+# starts quickly.
+pc_mod = 12
+prime_form = 0
 
 
 def about():
@@ -35,6 +52,126 @@ def about():
         "along with this program. If not, see https://www.gnu.org/licenses/."))
 
 
+def batch(file, output, max_workers=1):
+    """
+    Runs commands in batch mode. Each line of the file holds one command, and the result of each command
+    is written to the output as one line of JSON. As in the interactive calculator, load and mod change
+    the state for the lines that follow. The state is tracked as the file is read, so the commands can be
+    spread across worker processes, each of which memoizes its own results.
+    :param file: The command file
+    :param output: The output file
+    :param max_workers: The number of processes
+    """
+    jobs = batch_jobs(file)
+    if max_workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for record in executor.map(batch_job, jobs, chunksize=BATCH_CHUNK_SIZE):
+                output.write(record + "\n")
+    else:
+        for job in jobs:
+            output.write(batch_job(job) + "\n")
+
+
+def batch_info(pcs) -> dict:
+    """
+    Gets info about the set class for batch mode
+    :param pcs: The loaded pcset
+    :return: A dictionary of results
+    """
+    from mgen import set_class_table
+    _, name, ic_vector, dsym = set_class_table.get_set_class_info(prime_form, pc_mod)
+    results = {"mod": pc_mod, "pcset": list(pcs), "prime_form": sorted(set_class_table.get_pcset(prime_form, pc_mod))}
+    if pc_mod == 12:
+        results["forte_name"] = name
+    results["ic_vector"] = list(ic_vector)
+    results["dsym"] = dsym
+    return results
+
+
+def batch_job(job) -> str:
+    """
+    Runs a batch command
+    :param job: A tuple of the line number, the command, the mod value, the loaded pcset, and an error
+    message if the command could not be read (otherwise None)
+    :return: The result, as a JSON string
+    """
+    global pc_mod, prime_form
+    line, command, pc_mod, pcs, error = job
+    record = {"line": line, "command": command}
+    try:
+        if error is not None:
+            raise ValueError(error)
+        from mgen import set_class_table
+        prime_form = set_class_table.get_set_class_info(set_class_table.get_mask(pcs), pc_mod)[0]
+        record.update(batch_query(*parse_command(command), pcs))
+    except Exception as e:
+        record["error"] = str(e)
+    return json.dumps(record)
+
+
+def batch_jobs(file):
+    """
+    Reads batch commands, keeping track of the mod value and the loaded pcset. Blank lines and lines
+    starting with # are skipped, and quit or exit ends the batch.
+    :param file: The command file
+    :return: A generator of jobs for batch_job
+    """
+    mod_value = 12
+    pcs = ()
+    for i, line in enumerate(file):
+        command = line.strip()
+        if len(command) == 0 or command.startswith("#"):
+            continue
+        error = None
+        if not validate_command(command):
+            error = "Invalid command"
+        else:
+            name, argument = parse_command(command)
+            try:
+                match name:
+                    case "exit" | "quit":
+                        return
+                    case "load":
+                        pcs = parse_pcset(argument, mod_value)
+                    case "mod":
+                        mod_value = parse_mod(argument)
+                        pcs = ()
+            except Exception:
+                error = f"Invalid {name} value"
+        yield i + 1, command, mod_value, pcs, error
+
+
+def batch_query(name, argument, pcs) -> dict:
+    """
+    Runs a batch command for the set class
+    :param name: The command name (see parse_command)
+    :param argument: The command argument
+    :param pcs: The loaded pcset
+    :return: A dictionary of results
+    """
+    from mgen import set_class_table
+    match name:
+        case "info" | "load":
+            return batch_info(pcs)
+        case "mod":
+            return {"mod": pc_mod}
+        case "search":
+            return {"search": [str(uto) for uto in get_utos(prime_form, pc_mod, get_mask_of(parser(argument)))]}
+        case "subsets":
+            return {"subsets": [list(subset) for subset in get_subsets(prime_form, pc_mod)]}
+        case "subsets prime":
+            subset_classes = set_class_table.get_subset_classes(prime_form, pc_mod)
+            results = {"subset_classes": [sorted(set_class_table.get_pcset(subset, pc_mod)) for subset in subset_classes]}
+            if pc_mod == 12:
+                results["forte_names"] = [set_class_table.get_set_class_info(subset)[1] for subset in subset_classes]
+            return results
+        case "transform":
+            from pctheory import pcset
+            return {"transform": sorted(pc.pc for pc in pcset.transform(get_pitch_classes(prime_form), argument))}
+    raise ValueError(f"The {name} command is not available in batch mode")
+
+
 def calculate():
     """
     Enters continuous calculation mode
@@ -47,19 +184,109 @@ def calculate():
         user_input = input("...> ").lower()
 
 
+def format_ic_vector(ic_vector) -> str:
+    """
+    Formats an IC vector like pctheory does
+    :param ic_vector: The IC vector
+    :return: The IC vector string
+    """
+    if pc_mod < 16:
+        return "[" + "".join(HEX_CHARS[count] for count in ic_vector) + "]"
+    return str(list(ic_vector))
+
+
+def format_pc(pc) -> str:
+    """
+    Formats a pitch class like pctheory does
+    :param pc: The pitch class
+    :return: The pitch-class string
+    """
+    if 10 < pc_mod <= 16:
+        return HEX_CHARS[pc]
+    elif pc_mod > 16:
+        return f"{pc:0>2}"
+    return str(pc)
+
+
+def format_prime_form(mask) -> str:
+    """
+    Formats a prime form name like pctheory does
+    :param mask: The prime form mask
+    :return: The prime form name
+    """
+    pcs = [pc for pc in range(pc_mod) if mask & (1 << pc)]
+    if pc_mod <= 16:
+        return "[" + "".join(HEX_CHARS[pc] for pc in pcs) + "]"
+    return "[" + ", ".join(f"{pc:0>2}" for pc in pcs) + "]"
+
+
+def get_mask_of(pcs) -> int:
+    """
+    Gets the mask of a list of pitch-class numbers in the current mod
+    :param pcs: A list of integers
+    :return: The mask
+    """
+    mask = 0
+    for n in pcs:
+        mask |= 1 << (n % pc_mod)
+    return mask
+
+
+def get_pitch_classes(mask, mod_value=None) -> set:
+    """
+    Gets the pctheory pitch classes of a mask
+    :param mask: The mask
+    :param mod_value: The mod value (if None, the current mod)
+    :return: A set of PitchClass objects
+    """
+    from pctheory import pitch
+    mod_value = pc_mod if mod_value is None else mod_value
+    return {pitch.PitchClass(pc, mod=mod_value) for pc in range(mod_value) if mask & (1 << pc)}
+
+
+@functools.lru_cache(maxsize=256)
+def get_subsets(mask, mod_value) -> tuple:
+    """
+    Gets the subsets of a set class. The subsets are memoized, so repeated queries are instant.
+    :param mask: The prime form mask
+    :param mod_value: The mod value
+    :return: The subsets, as a sorted tuple of sorted pcsets
+    """
+    from mgen import set_class_table
+    return tuple(sorted(tuple(sorted(set_class_table.get_pcset(submask, mod_value)))
+                        for submask in set_class_table.get_submasks(mask)))
+
+
+@functools.lru_cache(maxsize=1024)
+def get_utos(mask, mod_value, search_mask) -> tuple:
+    """
+    Finds the UTOs that map a set class onto a pcset. The results are memoized, so repeated
+    searches are instant.
+    :param mask: The prime form mask
+    :param mod_value: The mod value
+    :param search_mask: The mask of the pcset to search for
+    :return: A sorted tuple of UTOs
+    """
+    from pctheory import pitch, transformations
+    pcs = {pitch.PitchClass(pc, mod=mod_value) for pc in range(mod_value) if search_mask & (1 << pc)}
+    return tuple(sorted(list(transformations.find_utos(get_pitch_classes(mask, mod_value), pcs))))
+
+
 def info():
     """
     Displays info about the set class
     """
-    if sc.mod == 12:
-        print("{0: <17}{1}".format("Prime form name:", sc.name_prime),
-            "\n{0: <17}{1}".format("Forte name:", sc.name_forte),
-            "\n{0: <17}{1}".format("IC vector:", sc.ic_vector_str),
-            "\n{0: <17}{1}".format("Dsym:", sc.dsym))
+    from mgen import set_class_table
+    _, name, ic_vector, dsym = set_class_table.get_set_class_info(prime_form, pc_mod)
+    if pc_mod == 12:
+        print("{0: <17}{1}".format("Prime form name:", format_prime_form(prime_form)),
+            "\n{0: <17}{1}".format("Forte name:", name),
+            "\n{0: <17}{1}".format("IC vector:", format_ic_vector(ic_vector)),
+            "\n{0: <17}{1}".format("Dsym:", dsym))
     else:
-        print("{0: <17}{1}".format("Prime form name:", sc.name_prime),
-            "\n{0: <17}{1}".format("IC vector:", sc.ic_vector_str),
-            "\n{0: <17}{1}".format("Dsym:", sc.dsym))
+        print("{0: <17}{1}".format("Prime form name:", format_prime_form(prime_form)),
+            "\n{0: <17}{1}".format("IC vector:", format_ic_vector(ic_vector)),
+            "\n{0: <17}{1}".format("Dsym:", dsym))
 
 
 def load(command, print_tn=False):
@@ -68,29 +295,43 @@ def load(command, print_tn=False):
     :param command: The set class prime form
     :param print_tn: Whether or not to print the transformation that was entered
     """
+    global prime_form
     try:
-        if '-' in command:
-            sc.load_from_name(command)
-        else:
-            pcs = {pitch.PitchClass(n, mod=sc.mod) for n in parser(command)}
-            sc.pcset = pcs
-            if print_tn:
-                print("You entered", sorted(list(transformations.find_utos(sc.pcset, pcs))))
+        from mgen import set_class_table
+        pcs = parse_pcset(command, pc_mod)
+        prime_form = set_class_table.get_set_class_info(set_class_table.get_mask(pcs), pc_mod)[0]
+        if print_tn and '-' not in command:
+            print("You entered", list(get_utos(prime_form, pc_mod, get_mask_of(pcs))))
         return True
     except Exception:
         print("Please enter a valid pcset to load...")
         return False
 
 
+def load_name(name, mod_value) -> int:
+    """
+    Finds a 12-EDO set class from its Forte name (such as 4-z15) or Morris name (such as (4-18)[0147])
+    :param name: The name
+    :param mod_value: The mod value
+    :return: The prime form mask
+    """
+    from mgen import set_class_table
+    if mod_value != 12:
+        raise ValueError("Set-class names are only available in mod 12.")
+    table = set_class_table.get_table()
+    name = name.upper().strip().lstrip("(").split(")")[0].replace("Z", "")
+    return int(table.prime_forms[[forte_name.replace("Z", "") for forte_name in table.names].index(name)])
+
+
 def mod(command):
     """
     Sets the mod of the set class
     :param command: The mod number
     """
-    global sc
+    global pc_mod, prime_form
     try:
-        command = int(command)
-        sc = pcset.SetClass(pc_mod=command)
+        pc_mod = parse_mod(command)
+        prime_form = 0
     except Exception:
         print("Please enter a valid number for the mod value...")
 
@@ -101,9 +342,7 @@ def search(command):
     :param command: The pcs to search for
     """
     try:
-        utos = transformations.find_utos(sc.pcset, {pitch.PitchClass(n, mod=sc.mod) for n in parser(command)})
-        utos = sorted(list(utos))
-        print(utos)
+        print(list(get_utos(prime_form, pc_mod, get_mask_of(parser(command)))))
     except Exception:
         print("Please enter a valid pcset to search for...")
 
@@ -112,18 +351,43 @@ def subsets():
     """
     Calculates the subsets of the set class
     """
-    s = pcset.subsets(sc.pcset)
-    s = sorted(list(s))
-    print(s)
+    print(subsets_str(prime_form, pc_mod))
+
+
+@functools.lru_cache(maxsize=256)
+def subsets_str(mask, mod_value) -> str:
+    """
+    Makes the subset list of a set class. The lists are memoized, so repeated queries are instant.
+    :param mask: The prime form mask
+    :param mod_value: The mod value
+    :return: The subsets, as a sorted list of pcsets
+    """
+    return "[" + ", ".join("[" + ", ".join(format_pc(pc) for pc in pcs) + "]" for pcs in get_subsets(mask, mod_value)) + "]"
 
 
 def subsets_prime():
     """
     Calculates the abstract subsets of the set class
     """
-    sp = sc.get_abstract_subset_classes()
-    sp = sorted(list(sp))
-    print(sp)
+    print(subsets_prime_str(prime_form, pc_mod))
+
+
+@functools.lru_cache(maxsize=256)
+def subsets_prime_str(mask, mod_value) -> str:
+    """
+    Makes the abstract subset list of a set class. The lists are memoized, so repeated queries are instant.
+    :param mask: The prime form mask
+    :param mod_value: The mod value
+    :return: The subset classes, in Forte order in mod 12, and otherwise by cardinality and prime form
+    """
+    from mgen import set_class_table
+    names = []
+    for subset in set_class_table.get_subset_classes(mask, mod_value):
+        if mod_value == 12:
+            names.append(f"({set_class_table.get_set_class_info(subset)[1]}){format_prime_form(subset)}")
+        else:
+            names.append(format_prime_form(subset))
+    return "[" + ", ".join(names) + "]"
 
 
 def transform(command):
@@ -131,11 +395,12 @@ def transform(command):
     Transforms the prime form of the set class
     :command: The transformation string
     """
-    tr = pcset.transform(sc.pcset, command)
+    from pctheory import pcset
+    tr = pcset.transform(get_pitch_classes(prime_form), command)
     tr = sorted(list(tr))
     print("{", end="")
     for i, pc in enumerate(tr):
-        if sc.mod == 12:
+        if pc_mod == 12:
             print(f"{pc}", end="")
         else:
             if i < len(tr) - 1:
@@ -184,6 +449,47 @@ def parser(command) -> list:
     return num_list
 
 
+def parse_command(command) -> tuple:
+    """
+    Gets the full name and the argument of a valid command
+    :param command: The command string
+    :return: The command name and the argument. For transformations, the name is "transform" and the
+    argument is the transformation string.
+    """
+    command = command.strip()
+    if command[0] in VALID_TRANSFORMATIONS:
+        return "transform", command
+    command_words = command.lower().split()
+    if len(command_words) > 1 and f"{command_words[0]} {command_words[1]}" in VALID_COMMANDS:
+        return f"{command_words[0]} {command_words[1]}", " ".join(command_words[2:])
+    return COMMAND_NAMES.get(command_words[0], command_words[0]), " ".join(command_words[1:])
+
+
+def parse_mod(command) -> int:
+    """
+    Parses a mod value
+    :param command: The mod number
+    :return: The mod value
+    """
+    mod_value = int(command)
+    if not 0 < mod_value <= MAX_MOD:
+        raise ValueError("Invalid mod value.")
+    return mod_value
+
+
+def parse_pcset(command, mod_value) -> tuple:
+    """
+    Parses a pcset, or a set-class name in mod 12 (see load_name)
+    :param command: The pcset or name
+    :param mod_value: The mod value
+    :return: A sorted tuple of pitch classes
+    """
+    from mgen import set_class_table
+    if '-' in command:
+        return tuple(sorted(set_class_table.get_pcset(load_name(command, mod_value))))
+    return tuple(sorted({n % mod_value for n in parser(command)}))
+
+
 def process_command(command: str) -> None:
     """
     Processes a valid command
@@ -303,9 +609,19 @@ def validate_transformation(transformation: str) -> bool:
 
 
 if __name__ == "__main__":
-    print(("#################### pcset calculator #####################\n"
-           "Copyright (c) 2024 by Jeffrey Martin. All rights reserved.\n"
-           "https://www.jeffreymartincomposer.com\n"
-           "This program is licensed under the GNU GPL v3 and comes\n"
-           "with ABSOLUTELY NO WARRANTY. For details, type \'about\'."))
-    menu()
+    arg_parser = argparse.ArgumentParser(description="pcset calculator")
+    arg_parser.add_argument("--batch", metavar="FILE", help="run the commands in FILE (- for stdin) and write JSON lines")
+    arg_parser.add_argument("--output", metavar="FILE", help="the JSON lines output file (stdout by default)")
+    arg_parser.add_argument("--workers", type=int, default=1, help="the number of worker processes in batch mode")
+    args = arg_parser.parse_args()
+    if args.batch is not None:
+        with open(args.batch) if args.batch != "-" else sys.stdin as batch_file, \
+                open(args.output, "w") if args.output is not None else sys.stdout as output_file:
+            batch(batch_file, output_file, args.workers)
+    else:
+        print(("#################### pcset calculator #####################\n"
+               "Copyright (c) 2024 by Jeffrey Martin. All rights reserved.\n"
+               "https://www.jeffreymartincomposer.com\n"
+               "This program is licensed under the GNU GPL v3 and comes\n"
+               "with ABSOLUTELY NO WARRANTY. For details, type \'about\'."))
+        menu()